@@ -0,0 +1,320 @@
+"""
+DuplicateFinder - Benchmark suite
+Generates synthetic FiveM resource trees and times each scan stage.
+
+Usage:
+    python benchmark.py --scales 10000,100000,1000000 --dup-ratio 0.2
+
+Every run appends one JSON line per scale to the output file, so results
+of different versions can be compared side by side.
+
+Author: Victor Z
+"""
+
+import os
+import sys
+import argparse
+import json
+import math
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import duplicate_finder as df
+
+
+# ===== TREE GENERATION =====
+DEFAULT_EXT_MIX = '.ycd:0.3,.ydr:0.4,.ytyp:0.1,.ybn:0.2'
+# Files written per leaf directory
+FILES_PER_DIR = 100
+
+
+def parse_ext_mix(value):
+    """Parse 'ext:weight,...' into a list of (ext, weight)."""
+    mix = []
+    for item in value.split(','):
+        ext, _, weight = item.partition(':')
+        ext = ext.strip().lower()
+        mix.append((ext if ext.startswith('.') else '.' + ext, float(weight or 1)))
+    return mix
+
+
+def dir_path(root, index, depth):
+    """Path of the index-th leaf directory, nested depth levels below a resource."""
+    parts = [root, f"res{index % 64}", "stream"]
+    parts.extend(f"l{(index // 64) % 8}_{level}" for level in range(max(0, depth - 2)))
+    parts.append(f"d{index}")
+    return os.path.join(*parts)
+
+
+def generate_tree(base, files, depth=4, dup_ratio=0.2, ext_mix=DEFAULT_EXT_MIX,
+                  size_median=16 * 1024, size_max=4 * 1024 * 1024, seed=1):
+    """
+    Create two resource roots 'a' and 'b' under base.
+
+    Half of the files go to each root. dup_ratio of the files in 'b' are
+    copies of files in 'a', half of them renamed. Sizes follow a log-normal
+    distribution around size_median. Returns a dict describing the tree.
+    """
+    rng = random.Random(seed)
+    mix = parse_ext_mix(ext_mix)
+    extensions = [ext for ext, _ in mix]
+    weights = [weight for _, weight in mix]
+    pool = os.urandom(size_max)
+
+    def size():
+        return max(16, min(size_max, int(rng.lognormvariate(math.log(size_median), 1.0))))
+
+    def write(path, uid, length):
+        # The uid prefix makes contents unique unless a file is a copy
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<Q', uid))
+            f.write(pool[:length - 8])
+
+    stats = {'files': 0, 'bytes': 0, 'duplicates': 0, 'renamed': 0}
+    created = set()
+
+    def place(root, k, name, uid, length):
+        folder = dir_path(os.path.join(base, root), k // FILES_PER_DIR, depth)
+        if folder not in created:
+            os.makedirs(folder, exist_ok=True)
+            created.add(folder)
+        write(os.path.join(folder, name), uid, length)
+        stats['files'] += 1
+        stats['bytes'] += length
+
+    count_a = (files + 1) // 2
+    originals = []
+    names_b = set()
+    for k in range(count_a):
+        ext = rng.choices(extensions, weights)[0]
+        length = size()
+        place('a', k, f"asset_{k}{ext}", k, length)
+        originals.append((k, ext, length))
+
+    for k in range(files - count_a):
+        if originals and rng.random() < dup_ratio:
+            uid, ext, length = rng.choice(originals)
+            if rng.random() < 0.5 and f"asset_{uid}{ext}" not in names_b:
+                name = f"asset_{uid}{ext}"
+            else:
+                name = f"copy_{uid}_{k}{ext}"
+                stats['renamed'] += 1
+            stats['duplicates'] += 1
+        else:
+            uid = count_a + k
+            ext = rng.choices(extensions, weights)[0]
+            length = size()
+            name = f"asset_{uid}{ext}"
+        names_b.add(name)
+        place('b', k, name, uid, length)
+
+    stats['dirs'] = len(created)
+    return stats
+
+
+# ===== STAGE TIMING =====
+def git_commit():
+    """Commit of the working tree, if it is a git checkout."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def match_names(files):
+    by_name = files.bucket(name.lower() for name in files.names())
+    return list(files.collisions(by_name))
+
+
+def measure_memory(base, extensions, scan_workers):
+    """
+    Traced memory of the walk and name matching, in bytes.
+
+    'table' is what the walked file table keeps and 'peak' the highest
+    usage up to the end of matching. Runs separately from time_stages()
+    since tracemalloc slows allocations down.
+    """
+    roots = [os.path.join(base, 'a'), os.path.join(base, 'b')]
+    tracemalloc.start()
+    try:
+        files = df.walk_roots(roots, extensions, scan_workers)
+        table, _ = tracemalloc.get_traced_memory()
+        match_names(files)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'table': table, 'peak': peak}
+
+
+def time_stages(base, extensions, scan_workers, hash_workers, compare_limit=df.COMPARE_MAX_FILES):
+    """Run walk, match, hash and result stages on a generated tree."""
+    roots = [os.path.join(base, 'a'), os.path.join(base, 'b')]
+    stages = {}
+    counts = {}
+
+    start = time.perf_counter()
+    files = df.walk_roots(roots, extensions, scan_workers)
+    stages['walk'] = time.perf_counter() - start
+    counts['files_walked'] = len(files)
+
+    start = time.perf_counter()
+    name_groups = match_names(files)
+    stages['match'] = time.perf_counter() - start
+    counts['name_groups'] = len(name_groups)
+
+    progress = df.ScanProgress()
+    start = time.perf_counter()
+    content_groups = list(df.iter_content_duplicates(
+        files, None, hash_workers, progress=progress, compare_limit=compare_limit
+    ))
+    stages['hash'] = time.perf_counter() - start
+    counts['content_groups'] = len(content_groups)
+    counts['bytes_hashed'] = progress.bytes_hashed
+
+    scanner = df.DuplicateScanner(extensions, match_mode="content")
+    start = time.perf_counter()
+    pairs = []
+    for size, digest, members in content_groups:
+        pairs.extend(scanner.group_pairs(scanner.make_group(digest, members)))
+    stages['results'] = time.perf_counter() - start
+    counts['pairs'] = len(pairs)
+
+    return stages, counts
+
+
+def measure_startup(runs=10):
+    """
+    Median wall time in seconds of starting the application in a fresh
+    interpreter: plain import, a CLI scan of two empty folders and the
+    import of the GUI toolkit. 'gui' is None when tkinter is missing.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'duplicate_finder.py')
+    empty = tempfile.mkdtemp(prefix='dupfinder_start_')
+    commands = {
+        'import': [sys.executable, '-c', 'import duplicate_finder'],
+        'cli': [sys.executable, script, 'scan', empty, empty, '--no-index'],
+        'gui': [sys.executable, '-c', 'import duplicate_finder; duplicate_finder.load_gui()'],
+    }
+    times = {}
+    try:
+        for name, command in commands.items():
+            samples = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                code = subprocess.call(command, cwd=os.path.dirname(script),
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                samples.append(time.perf_counter() - start)
+                if code:
+                    break
+            times[name] = None if code else sorted(samples)[len(samples) // 2]
+    finally:
+        os.rmdir(empty)
+    return times
+
+
+def run(args, scale):
+    base = tempfile.mkdtemp(prefix='dupfinder_bench_', dir=args.dir)
+    try:
+        start = time.perf_counter()
+        tree = generate_tree(
+            base, scale, args.depth, args.dup_ratio, args.ext_mix,
+            args.size_median, args.size_max, args.seed
+        )
+        generate = time.perf_counter() - start
+
+        extensions = {ext for ext, _ in parse_ext_mix(args.ext_mix)}
+        stages, counts = time_stages(base, extensions, args.workers, args.hash_workers, args.compare_limit)
+        memory = measure_memory(base, extensions, args.workers) if args.memory else None
+    finally:
+        if not args.keep:
+            shutil.rmtree(base, ignore_errors=True)
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'files': scale,
+            'depth': args.depth,
+            'dup_ratio': args.dup_ratio,
+            'ext_mix': args.ext_mix,
+            'size_median': args.size_median,
+            'size_max': args.size_max,
+            'seed': args.seed,
+            'workers': args.workers,
+            'hash_workers': args.hash_workers,
+            'compare_limit': args.compare_limit,
+        },
+        'tree': tree,
+        'generate_seconds': generate,
+        'stages': stages,
+        'counts': counts,
+        'memory': memory,
+    }
+
+
+# ===== COMMAND LINE =====
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark DuplicateFinder on synthetic resource trees.')
+    parser.add_argument('--scales', default='10000',
+                        help='comma separated file counts, e.g. 10000,100000,1000000 (default: 10000)')
+    parser.add_argument('--depth', type=int, default=4, help='directory levels below each resource')
+    parser.add_argument('--dup-ratio', type=float, default=0.2, help='share of folder b files copied from folder a')
+    parser.add_argument('--ext-mix', default=DEFAULT_EXT_MIX, help='extension weights (default: %(default)s)')
+    parser.add_argument('--size-median', type=int, default=16 * 1024, help='median file size in bytes')
+    parser.add_argument('--size-max', type=int, default=4 * 1024 * 1024, help='largest file size in bytes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=df.SCAN_WORKERS, help='directory walking threads')
+    parser.add_argument('--hash-workers', type=int, default=df.HASH_WORKERS, help='hashing threads')
+    parser.add_argument('--compare-limit', type=int, default=df.COMPARE_MAX_FILES,
+                        help='largest candidate group compared side by side instead of hashed (0 always hashes)')
+    parser.add_argument('--dir', help='where to create the temporary trees (default: system temp)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated trees')
+    parser.add_argument('--memory', action='store_true',
+                        help='also record memory of the walk and name matching with tracemalloc')
+    parser.add_argument('--startup', action='store_true',
+                        help='measure cold start times of the CLI and the GUI instead of scanning')
+    parser.add_argument('--output', default='bench_results.jsonl', help='JSON Lines file results are appended to')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        startup = measure_startup()
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'startup': startup,
+            }) + '\n')
+        print('  '.join(f"{name} {'n/a' if seconds is None else f'{seconds * 1000:.0f} ms'}"
+                        for name, seconds in startup.items()))
+        return 0
+
+    for scale in (int(value) for value in args.scales.split(',')):
+        result = run(args, scale)
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result) + '\n')
+
+        stages = '  '.join(f"{name} {seconds:.3f}s" for name, seconds in result['stages'].items())
+        line = f"{scale:>9} files  {stages}  ({result['counts']['content_groups']} groups)"
+        if result['memory']:
+            line += f"  peak {result['memory']['peak'] / 1e6:.1f} MB"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,23 +2,59 @@
 DuplicateFinder - Tool for finding and removing duplicate files between folders
 Developed for FiveM/RedM - Extensions: .ycd, .ydr, .ytyp, .ybn
 
+Run without arguments to open the GUI, or use the headless CLI:
+    python duplicate_finder.py scan DIR1 DIR2 --ext .ydr,.ycd --format json
+
 Author: Victor Z
 """
 
 import os
 import sys
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from collections import defaultdict
+import argparse
+import errno
+import json
+import io
+import mmap
+import queue
+import select
+import stat
+import struct
+import time
+import zlib
+from array import array
+from collections import defaultdict, deque, namedtuple
 import threading
 
-# Install send2trash if not exists
-try:
-    from send2trash import send2trash
-except ImportError:
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "send2trash", "-q"])
-    from send2trash import send2trash
+# GUI modules are imported by load_gui() so headless runs never load tkinter.
+# Other costly modules (hashlib, sqlite3, concurrent.futures, cProfile, csv,
+# send2trash, XML and ctypes) are imported by the functions that use them,
+# so startup time does not grow with every feature.
+tk = ttk = filedialog = messagebox = None
+
+
+def load_gui():
+    """Import tkinter on first use."""
+    global tk, ttk, filedialog, messagebox
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+
+
+SEND2TRASH_MISSING = "send2trash is required to move files to the recycle bin (pip install send2trash)"
+
+
+def has_send2trash():
+    """Check that send2trash is installed, without importing it."""
+    import importlib.util
+    return importlib.util.find_spec('send2trash') is not None
+
+
+def load_send2trash():
+    """Import send2trash on first use."""
+    try:
+        from send2trash import send2trash
+    except ImportError:
+        raise ImportError(SEND2TRASH_MISSING) from None
+    return send2trash
 
 
 # ===== INTERNATIONALIZATION =====
@@ -38,13 +74,35 @@ TRANSLATIONS = {
         'ext_ytyp': '.ytyp (Types)',
         'ext_ybn': '.ybn (Collisions)',
         'delete_from': 'Delete duplicates from:',
+        'dry_run': 'Dry run (journal only)',
+        'match_by': 'Match by:',
+        'match_name': 'Filename',
+        'match_content': 'Content (hash)',
+        'match_structure': 'Resource content (RSC7)',
+        'match_near': 'Similar maps (YTYP/YMAP)',
+        'use_index': 'Cache hashes between scans',
+        'profile': 'Profile scan',
+        'watch': 'Watch for changes',
+        'archives': 'Look inside .rpf archives',
         'scan_btn': '🔍 Scan for Duplicates',
         'delete_btn': '🗑️ Move to Recycle Bin',
+        'link_btn': '🔗 Replace with Links',
+        'snapshot_btn': '💾 Save Snapshot',
         'clear_btn': '🔄 Clear',
+        'cancel_btn': '⏹️ Cancel',
         'status_ready': 'Ready to scan...',
         'status_scanning': '⏳ Scanning...',
+        'status_walking': '⏳ Scanning... {files} files found',
+        'status_hashing': '⏳ Hashing... {hashed} of {total} | ETA {eta}',
+        'status_cancelled': 'Scan cancelled - showing partial results',
         'status_complete': 'Scan complete!',
+        'status_profile_saved': 'Scan complete! Profile saved to {path}',
+        'status_watching': '👁️ Watching for changes... {count} update(s)',
+        'status_watch_stopped': 'Stopped watching for changes',
+        'status_archives_skipped': 'Scan complete! {count} encrypted or unreadable archive(s) skipped',
         'status_deleting': '🗑️ Moving to recycle bin...',
+        'status_deleting_progress': '🗑️ Moving to recycle bin... {done}/{total}',
+        'status_dry_run': 'Dry run complete: {count} file(s) would be moved',
         'results': '📋 Results',
         'col_filename': 'Filename',
         'col_path1': 'Folder 1 Path',
@@ -55,6 +113,7 @@ TRANSLATIONS = {
         'warn_select_folders': 'Please select both folders before scanning!',
         'err_folder1_not_found': 'Folder 1 not found:\n{path}',
         'err_folder2_not_found': 'Folder 2 not found:\n{path}',
+        'err_folders_overlap': 'The folders must not overlap:\n{error}',
         'warn_select_extension': 'Please select at least one extension!',
         'info_no_duplicates': 'No duplicates to remove!',
         'confirm_delete_title': 'Confirm Deletion',
@@ -62,6 +121,30 @@ TRANSLATIONS = {
         'complete_title': 'Complete',
         'complete_msg': '✅ Files moved to recycle bin: {success}\n❌ Errors: {errors}\n\nFiles can be restored from Windows Recycle Bin.',
         'status_removed': 'Complete: {count} files removed',
+        'journal_msg': 'Journal: {path}',
+        'dry_run_msg': 'Dry run: {count} file(s) would be moved to the Recycle Bin.',
+        'err_delete': 'Error while moving files:\n{error}',
+        'err_send2trash': 'Moving files to the Recycle Bin needs the send2trash package.\n\nInstall it with:\npip install send2trash',
+        'confirm_link_title': 'Confirm Linking',
+        'confirm_link_msg': 'Replace {count} file(s) in {folder} with links to the identical copies in the other folder?\n\nThe content hash of each file is checked right before it is replaced; files that differ are left untouched.',
+        'status_linking': '🔗 Replacing with links...',
+        'status_linking_progress': '🔗 Replacing with links... {done}/{total}',
+        'link_complete_msg': '✅ Files replaced with links: {success}\n⏭️ Skipped (different or already linked): {skipped}\n❌ Errors: {errors}\n\nSpace reclaimed: {size}',
+        'status_linked': 'Complete: {count} files linked, {size} reclaimed',
+        'dry_run_link_msg': 'Dry run: {count} file(s) would be replaced with links.',
+        'status_dry_run_link': 'Dry run complete: {count} file(s) would be linked',
+        'err_link': 'Error while linking files:\n{error}',
+        'snapshot_title': 'Save Scan Snapshot',
+        'snapshot_files': 'Scan snapshots',
+        'status_snapshot_saved': 'Snapshot of {count} group(s) saved to {path}',
+        'err_snapshot': 'Error while saving the snapshot:\n{error}',
+        'rules_btn': '📜 Rules...',
+        'rules_none': 'No rules file',
+        'rules_title': 'Open Rules File',
+        'rules_files': 'Rules files',
+        'err_rules': 'Error while reading the rules file:\n{error}',
+        'delete_by_rules': 'By rules',
+        'rules_folders': 'both folders (keeping the copies picked by the rules)',
         'err_scan': 'Error during scan:\n{error}',
         'lang_btn': '🌐 PT-BR',
         'select_folder_title': 'Select Folder {num}'
@@ -81,13 +164,35 @@ TRANSLATIONS = {
         'ext_ytyp': '.ytyp (Tipos)',
         'ext_ybn': '.ybn (Colisões)',
         'delete_from': 'Deletar duplicados de:',
+        'dry_run': 'Simulação (apenas registro)',
+        'match_by': 'Comparar por:',
+        'match_name': 'Nome do arquivo',
+        'match_content': 'Conteúdo (hash)',
+        'match_structure': 'Conteúdo do recurso (RSC7)',
+        'match_near': 'Mapas semelhantes (YTYP/YMAP)',
+        'use_index': 'Guardar hashes entre verificações',
+        'profile': 'Perfilar verificação',
+        'watch': 'Monitorar alterações',
+        'archives': 'Procurar dentro de arquivos .rpf',
         'scan_btn': '🔍 Verificar Duplicados',
         'delete_btn': '🗑️ Mover para Lixeira',
+        'link_btn': '🔗 Substituir por Links',
+        'snapshot_btn': '💾 Salvar Snapshot',
         'clear_btn': '🔄 Limpar',
+        'cancel_btn': '⏹️ Cancelar',
         'status_ready': 'Pronto para verificar...',
         'status_scanning': '⏳ Verificando...',
+        'status_walking': '⏳ Verificando... {files} arquivos encontrados',
+        'status_hashing': '⏳ Calculando hashes... {hashed} de {total} | Restante {eta}',
+        'status_cancelled': 'Verificação cancelada - resultados parciais',
         'status_complete': 'Verificação concluída!',
+        'status_profile_saved': 'Verificação concluída! Perfil salvo em {path}',
+        'status_watching': '👁️ Monitorando alterações... {count} atualização(ões)',
+        'status_watch_stopped': 'Monitoramento de alterações encerrado',
+        'status_archives_skipped': 'Verificação concluída! {count} arquivo(s) .rpf criptografado(s) ou ilegível(is) ignorado(s)',
         'status_deleting': '🗑️ Movendo para lixeira...',
+        'status_deleting_progress': '🗑️ Movendo para lixeira... {done}/{total}',
+        'status_dry_run': 'Simulação concluída: {count} arquivo(s) seriam movidos',
         'results': '📋 Resultados',
         'col_filename': 'Arquivo',
         'col_path1': 'Caminho Pasta 1',
@@ -98,6 +203,7 @@ TRANSLATIONS = {
         'warn_select_folders': 'Selecione as duas pastas antes de verificar!',
         'err_folder1_not_found': 'Pasta 1 não encontrada:\n{path}',
         'err_folder2_not_found': 'Pasta 2 não encontrada:\n{path}',
+        'err_folders_overlap': 'As pastas não podem se sobrepor:\n{error}',
         'warn_select_extension': 'Selecione pelo menos uma extensão!',
         'info_no_duplicates': 'Nenhum duplicado para remover!',
         'confirm_delete_title': 'Confirmar Exclusão',
@@ -105,6 +211,30 @@ TRANSLATIONS = {
         'complete_title': 'Concluído',
         'complete_msg': '✅ Arquivos movidos para lixeira: {success}\n❌ Erros: {errors}\n\nOs arquivos podem ser restaurados da Lixeira do Windows.',
         'status_removed': 'Concluído: {count} arquivos removidos',
+        'journal_msg': 'Registro: {path}',
+        'dry_run_msg': 'Simulação: {count} arquivo(s) seriam movidos para a Lixeira.',
+        'err_delete': 'Erro ao mover arquivos:\n{error}',
+        'err_send2trash': 'Mover arquivos para a Lixeira requer o pacote send2trash.\n\nInstale com:\npip install send2trash',
+        'confirm_link_title': 'Confirmar Links',
+        'confirm_link_msg': 'Substituir {count} arquivo(s) da {folder} por links para as cópias idênticas da outra pasta?\n\nO hash do conteúdo de cada arquivo é verificado logo antes da substituição; arquivos diferentes não são alterados.',
+        'status_linking': '🔗 Substituindo por links...',
+        'status_linking_progress': '🔗 Substituindo por links... {done}/{total}',
+        'link_complete_msg': '✅ Arquivos substituídos por links: {success}\n⏭️ Ignorados (diferentes ou já vinculados): {skipped}\n❌ Erros: {errors}\n\nEspaço recuperado: {size}',
+        'status_linked': 'Concluído: {count} arquivos vinculados, {size} recuperados',
+        'dry_run_link_msg': 'Simulação: {count} arquivo(s) seriam substituídos por links.',
+        'status_dry_run_link': 'Simulação concluída: {count} arquivo(s) seriam vinculados',
+        'err_link': 'Erro ao criar links:\n{error}',
+        'snapshot_title': 'Salvar Snapshot da Verificação',
+        'snapshot_files': 'Snapshots de verificação',
+        'status_snapshot_saved': 'Snapshot de {count} grupo(s) salvo em {path}',
+        'err_snapshot': 'Erro ao salvar o snapshot:\n{error}',
+        'rules_btn': '📜 Regras...',
+        'rules_none': 'Nenhum arquivo de regras',
+        'rules_title': 'Abrir Arquivo de Regras',
+        'rules_files': 'Arquivos de regras',
+        'err_rules': 'Erro ao ler o arquivo de regras:\n{error}',
+        'delete_by_rules': 'Pelas regras',
+        'rules_folders': 'ambas as pastas (mantendo as cópias escolhidas pelas regras)',
         'err_scan': 'Erro ao verificar:\n{error}',
         'lang_btn': '🌐 EN',
         'select_folder_title': 'Selecione a Pasta {num}'
@@ -112,6 +242,3245 @@ TRANSLATIONS = {
 }
 
 
+# ===== SCAN PROGRESS =====
+class ScanProgress:
+    """
+    Counters of a running scan, shared with whoever displays its progress.
+    
+    The scan threads update the counters and the UI reads snapshot() at its
+    own pace, so progress reporting never slows the scan down. cancel() asks
+    every stage of the scan to stop as soon as possible.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.started = time.monotonic()
+        self.hash_started = None
+        self.stage = 'walk'
+        self.dirs_walked = 0
+        self.files_walked = 0
+        self.bytes_to_hash = 0
+        self.bytes_hashed = 0
+        self.groups_found = 0
+        self.archives_skipped = 0
+    
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+    
+    def set_stage(self, stage):
+        self.stage = stage
+        if stage == 'hash' and self.hash_started is None:
+            self.hash_started = time.monotonic()
+    
+    def cancel(self):
+        self.cancelled.set()
+    
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+    
+    def eta(self):
+        """Estimated seconds left while hashing, or None if unknown."""
+        with self.lock:
+            hashed, total = self.bytes_hashed, self.bytes_to_hash
+        if self.hash_started is None or not hashed or total <= hashed:
+            return None
+        elapsed = time.monotonic() - self.hash_started
+        return elapsed * (total - hashed) / hashed
+    
+    def snapshot(self):
+        with self.lock:
+            snapshot = {
+                'stage': self.stage,
+                'elapsed': time.monotonic() - self.started,
+                'dirs_walked': self.dirs_walked,
+                'files_walked': self.files_walked,
+                'bytes_to_hash': self.bytes_to_hash,
+                'bytes_hashed': self.bytes_hashed,
+                'groups_found': self.groups_found,
+                'archives_skipped': self.archives_skipped,
+            }
+        snapshot['eta'] = self.eta()
+        return snapshot
+
+
+# ===== PROFILING =====
+# Profiler counting I/O of the running scan, set by ScanProfiler.activate()
+_active_profiler = None
+
+
+def _count(**counts):
+    """Add I/O counters to the active profiler, if any."""
+    profiler = _active_profiler
+    if profiler is not None:
+        profiler.count(**counts)
+
+
+class ScanProfiler:
+    """
+    Opt-in per-stage instrumentation of a scan.
+    
+    Records wall time, process CPU time and I/O counters (directory
+    listings, stats, opens, reads, bytes read) for each stage. While active,
+    the scanning and hashing functions report their I/O through _count().
+    cProfile data of the scanning thread can be dumped to a pstats file.
+    """
+    
+    # Folder next to the application holding profiles saved by the GUI
+    DIRNAME = 'profiles'
+    COUNTERS = ('files', 'scandir', 'stat', 'open', 'read', 'mmap', 'bytes_read')
+    
+    def __init__(self, use_cprofile=False):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.stages = {}
+        self.current = None
+        self.mark = None
+        self.cprofile = None
+        if use_cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+    
+    def activate(self):
+        """Start counting I/O and, if enabled, profiling the calling thread."""
+        global _active_profiler
+        _active_profiler = self
+        if self.cprofile is not None:
+            self.cprofile.enable()
+    
+    def deactivate(self):
+        global _active_profiler
+        self.end()
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if _active_profiler is self:
+            _active_profiler = None
+    
+    def count(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                self.counters[name] += value
+    
+    def begin(self, stage, threads=1):
+        """End the current stage and start timing a new one."""
+        self.end()
+        with self.lock:
+            counters = dict(self.counters)
+        self.current = stage
+        self.mark = (time.perf_counter(), time.process_time(), counters, threads)
+    
+    def end(self):
+        if self.current is None:
+            return
+        wall, cpu, before, threads = self.mark
+        with self.lock:
+            after = dict(self.counters)
+        stage = self.stage_record(self.current, threads)
+        stage['wall'] += time.perf_counter() - wall
+        stage['cpu'] += time.process_time() - cpu
+        for name in self.COUNTERS:
+            stage[name] += after[name] - before[name]
+        self.current = None
+    
+    def add(self, stage, seconds, **counts):
+        """Add time spent outside the scan thread, e.g. updating the UI."""
+        with self.lock:
+            record = self.stage_record(stage, 1)
+            record['wall'] += seconds
+            record['cpu'] += seconds
+            for name, value in counts.items():
+                record[name] += value
+    
+    def stage_record(self, stage, threads):
+        if stage not in self.stages:
+            self.stages[stage] = dict.fromkeys(('wall', 'cpu') + self.COUNTERS, 0)
+            self.stages[stage]['threads'] = threads
+        return self.stages[stage]
+    
+    def bottleneck(self):
+        """Return (stage, 'disk' | 'cpu' | 'ui') for the slowest stage."""
+        if not self.stages:
+            return None, None
+        name, stage = max(self.stages.items(), key=lambda item: item[1]['wall'])
+        if name in ('ui', 'output'):
+            return name, 'ui'
+        # A CPU bound stage keeps most of its threads busy
+        busy = stage['cpu'] / stage['wall'] if stage['wall'] else 0
+        cores = min(stage['threads'], os.cpu_count() or 1)
+        return name, 'cpu' if busy >= 0.7 * cores else 'disk'
+    
+    def summary(self):
+        stage, kind = self.bottleneck()
+        return {'stages': self.stages, 'bottleneck': stage, 'bound_by': kind}
+    
+    def format_summary(self):
+        lines = [f"{'stage':<10}{'wall':>9}{'cpu':>9}{'files':>9}{'scandir':>9}{'stat':>9}"
+                 f"{'open':>9}{'read':>9}{'MB read':>10}"]
+        for name, st in self.stages.items():
+            lines.append(
+                f"{name:<10}{st['wall']:>8.3f}s{st['cpu']:>8.3f}s{st['files']:>9}{st['scandir']:>9}"
+                f"{st['stat']:>9}{st['open']:>9}{st['read']:>9}{st['bytes_read'] / 1048576:>10.1f}"
+            )
+        stage, kind = self.bottleneck()
+        if stage is not None:
+            lines.append(f"Slowest stage: {stage} ({kind} bound)")
+        return '\n'.join(lines)
+    
+    def save(self, path):
+        """Write the summary as JSON, and cProfile data next to it as .pstats."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(os.path.splitext(path)[0] + '.pstats')
+        return path
+
+
+# ===== DIRECTORY SCANNING =====
+# Threads used to list directories; listing is latency bound, not CPU bound
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Stat data of a walked file. inode is 0 on Windows, where DirEntry.stat() leaves it unset.
+FileInfo = namedtuple('FileInfo', ['path', 'size', 'mtime_ns', 'inode'])
+
+
+class FileTable:
+    """
+    Compact table of the files found by a walk.
+    
+    Files are numbered in the order they were added. Each directory path is
+    stored once together with the basenames of its files joined into a
+    single string, and every file only keeps its directory number, the
+    offset of its basename and its stat data in typed arrays. That is about
+    40 bytes per file instead of a FileInfo tuple, a path string and three
+    int objects. FileInfo records are built on demand by info().
+    """
+    
+    def __init__(self, roots=()):
+        self.roots = list(roots)
+        self.dirs = []
+        self.dir_names = []
+        self.dir_root = array('H')
+        self.file_dir = array('I')
+        self.name_start = array('I')
+        self.name_len = array('H')
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.inodes = array('Q')
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.sizes)
+    
+    def add_directory(self, root, path, files):
+        """
+        Add the (name, size, mtime_ns, inode) files of one directory. Thread safe.
+        
+        Raises ValueError, leaving the table unchanged, if a value does not
+        fit its array, e.g. a name longer than 65535 characters.
+        """
+        if not files:
+            return
+        names = [f[0] for f in files]
+        starts = []
+        offset = 0
+        for name in names:
+            starts.append(offset)
+            offset += len(name)
+        # Convert the whole directory first so a bad value cannot leave the arrays misaligned
+        try:
+            name_start = array('I', starts)
+            name_len = array('H', [len(name) for name in names])
+            sizes = array('q', [f[1] for f in files])
+            mtimes = array('q', [f[2] for f in files])
+            inodes = array('Q', [f[3] for f in files])
+        except OverflowError:
+            raise ValueError(f"File data out of range in {path}") from None
+        with self.lock:
+            dir_id = len(self.dirs)
+            self.dirs.append(path)
+            self.dir_names.append(''.join(names))
+            self.dir_root.append(root)
+            self.file_dir.extend(array('I', [dir_id]) * len(files))
+            self.name_start.extend(name_start)
+            self.name_len.extend(name_len)
+            self.sizes.extend(sizes)
+            self.mtimes.extend(mtimes)
+            self.inodes.extend(inodes)
+    
+    def root(self, i):
+        return self.dir_root[self.file_dir[i]]
+    
+    def name(self, i):
+        start = self.name_start[i]
+        return self.dir_names[self.file_dir[i]][start:start + self.name_len[i]]
+    
+    def path(self, i):
+        return os.path.join(self.dirs[self.file_dir[i]], self.name(i))
+    
+    def info(self, i):
+        return FileInfo(self.path(i), self.sizes[i], self.mtimes[i], self.inodes[i])
+    
+    def entry(self, i):
+        """Return the (root, FileInfo) member tuple used by the matchers."""
+        return self.root(i), self.info(i)
+    
+    def names(self):
+        """Yield the basename of every file, in file order."""
+        dir_names = self.dir_names
+        for d, start, length in zip(self.file_dir, self.name_start, self.name_len):
+            yield dir_names[d][start:start + length]
+    
+    def paths(self):
+        for i in range(len(self)):
+            yield self.path(i)
+    
+    def bucket(self, keys):
+        """
+        Group file numbers by the key yielded for each file, skipping None keys.
+        
+        A key seen once maps to the bare file number and only shared keys
+        get a list, since most keys of a large tree are unique.
+        """
+        buckets = {}
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            found = buckets.get(key)
+            if found is None:
+                buckets[key] = i
+            elif isinstance(found, int):
+                buckets[key] = [found, i]
+            else:
+                found.append(i)
+        return buckets
+    
+    def collisions(self, buckets):
+        """Yield (key, members) of buckets holding files of more than one root."""
+        for key, ids in buckets.items():
+            if isinstance(ids, int):
+                continue
+            first = self.root(ids[0])
+            if any(self.root(i) != first for i in ids):
+                yield key, [self.entry(i) for i in ids]
+
+
+def has_extension(name, extensions):
+    """Check a filename against a set of lowercase extensions."""
+    dot = name.rfind('.')
+    return dot > 0 and name[dot:].lower() in extensions
+
+
+def scan_directory(path, extensions):
+    """
+    List one directory.
+    
+    Returns (files, subdirs) where files are (name, size, mtime_ns, inode)
+    tuples built from the DirEntry stat data. Unreadable directories are
+    skipped like os.walk does.
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif has_extension(entry.name, extensions) and entry.is_file():
+                        st = entry.stat()
+                        files.append((entry.name, st.st_size, st.st_mtime_ns, st.st_ino))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    _count(scandir=1, stat=len(files), files=len(files))
+    return files, subdirs
+
+
+def walk_roots(roots, extensions, workers=SCAN_WORKERS, progress=None, archives=False, rules=None,
+               rule_roots=None):
+    """
+    Walk several directory trees at the same time.
+    
+    Every directory is listed as a separate task on a thread pool and queues
+    its own subdirectories, so all roots are fanned out across the workers
+    without a round trip through the calling thread. Returns a FileTable of
+    the files of all roots. With archives, the entries of .rpf archives are
+    added as virtual files below the archive path. ScanRules filter the
+    listed files and keep excluded folders from being walked at all; their
+    globs match paths relative to rule_roots, which default to roots. A
+    cancelled ScanProgress stops the walk early with partial results. The
+    first unexpected error of a worker stops the walk and is raised.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    table = FileTable(roots)
+    listed = set(extensions) | {RPF_EXTENSION} if archives else extensions
+    bases = roots if rule_roots is None else rule_roots
+    lock = threading.Lock()
+    finished = threading.Event()
+    pending = [0]
+    errors = []
+    
+    def visit(i, path):
+        try:
+            if errors or (progress is not None and progress.is_cancelled()):
+                return
+            files, subdirs = scan_directory(path, listed)
+            if rules is not None:
+                files, subdirs = rules.filter_directory(bases[i], path, files, subdirs)
+            if archives:
+                loose = []
+                for f in files:
+                    if has_extension(f[0], (RPF_EXTENSION,)):
+                        add_archive(table, i, os.path.join(path, f[0]), extensions, progress, rules, bases[i])
+                        if RPF_EXTENSION not in extensions:
+                            continue
+                    loose.append(f)
+                files = loose
+            if progress is not None:
+                progress.add(dirs_walked=1, files_walked=len(files))
+            table.add_directory(i, path, files)
+            with lock:
+                pending[0] += len(subdirs)
+            for subdir in subdirs:
+                pool.submit(visit, i, subdir)
+        except Exception as e:
+            # Raised by the caller once the pool is done; a lost subtree must not look like a clean walk
+            with lock:
+                errors.append(e)
+        finally:
+            with lock:
+                pending[0] -= 1
+                if pending[0] == 0:
+                    finished.set()
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        start = [(i, root) for i, root in enumerate(roots) if os.path.isdir(root)]
+        pending[0] = len(start)
+        if not start:
+            finished.set()
+        for i, root in start:
+            pool.submit(visit, i, root)
+        finished.wait()
+    
+    if errors:
+        raise errors[0]
+    return table
+
+
+# ===== SCAN RULES =====
+RULES_KEYS = ('extension_groups', 'extensions', 'include', 'exclude', 'keep')
+KEEP_POLICIES = ('preferred_root', 'newest', 'shortest_path')
+
+
+def _extension(value):
+    value = value.strip().lower()
+    return value if value.startswith('.') else '.' + value
+
+
+def _string_list(field, value):
+    """Return value as a list, raising ValueError unless it is a list of strings."""
+    if not isinstance(value, (list, tuple)) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"{field} must be a list of strings")
+    return list(value)
+
+
+def _glob_regex(patterns):
+    """
+    Compile globs matched against lowercase, '/' separated relative paths.
+    
+    Patterns without '/' match a file or folder name at any depth, a
+    leading '**/' matches any number of folders and a trailing '/**'
+    matches a folder and everything below it. Square brackets match
+    themselves, since FiveM folders are named like [core].
+    """
+    import fnmatch
+    import re
+    
+    forms = []
+    for pattern in patterns:
+        pattern = pattern.strip().replace('\\', '/').strip('/').lower()
+        if not pattern:
+            continue
+        if '/' not in pattern:
+            pattern = '**/' + pattern
+        variants = [pattern, pattern[:-3]] if pattern.endswith('/**') else [pattern]
+        for variant in variants:
+            forms.append(variant)
+            if variant.startswith('**/'):
+                forms.append(variant[3:])
+    if not forms:
+        return None
+    # '[[]' and '[]]' are the fnmatch spellings of a literal bracket
+    forms = [re.sub(r'[\[\]]', lambda m: '[' + m.group() + ']', form) for form in forms]
+    return re.compile('|'.join(fnmatch.translate(form) for form in forms))
+
+
+def _member_mtime(path):
+    """Modification time of a group member; files inside archives take the archive's."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        parts = split_archive_path(path)
+        if parts is not None:
+            try:
+                return os.stat(parts[0]).st_mtime_ns
+            except OSError:
+                pass
+    return 0
+
+
+class ScanRules:
+    """
+    Extension sets, path filters and keep policies read from a rules file.
+    
+    extension_groups maps names to extension lists, and extensions lists
+    the group names or single extensions to scan. include and exclude are
+    globs matched against paths relative to the scanned folder; excluded
+    folders are never descended into. keep is a list of rules like
+    {"group": "models", "policy": ["preferred_root", "newest"],
+    "prefer": ["resources/[core]"]}. The first rule whose extension group
+    holds the extension of a duplicate group, or that names no group,
+    picks the file to keep. Its policies are applied in order and ties go
+    to the first folder and path. Relative prefer paths are resolved
+    against base.
+    """
+    
+    def __init__(self, extension_groups=None, extensions=None, include=(), exclude=(), keep=(), base=''):
+        if not isinstance(extension_groups or {}, dict):
+            raise ValueError("extension_groups must map group names to lists of extensions")
+        self.extension_groups = {
+            name: {_extension(ext) for ext in _string_list(f"extension_groups.{name}", exts)}
+            for name, exts in (extension_groups or {}).items()
+        }
+        self.extensions = None
+        if extensions:
+            self.extensions = set()
+            for item in _string_list('extensions', extensions):
+                self.extensions |= self.extension_groups.get(item) or {_extension(item)}
+        self.include = _glob_regex(_string_list('include', include))
+        self.exclude = _glob_regex(_string_list('exclude', exclude))
+        
+        self.keep = []
+        if not isinstance(keep, (list, tuple)) or not all(isinstance(rule, dict) for rule in keep):
+            raise ValueError('keep must be a list of rules like {"policy": ["newest"]}')
+        for rule in keep:
+            group = rule.get('group')
+            if group is not None and group not in self.extension_groups:
+                raise ValueError(f"keep rule names an unknown extension group: {group}")
+            policies = rule.get('policy', [])
+            policies = _string_list('keep policy', [policies] if isinstance(policies, str) else policies)
+            for policy in policies:
+                if policy not in KEEP_POLICIES:
+                    raise ValueError(f"unknown keep policy: {policy} (use {', '.join(KEEP_POLICIES)})")
+            prefer = [
+                os.path.normpath(os.path.join(base, path)) for path in _string_list('keep prefer', rule.get('prefer', []))
+            ]
+            if 'preferred_root' in policies and not prefer:
+                raise ValueError("the preferred_root policy needs a prefer list")
+            self.keep.append((self.extension_groups.get(group), policies, prefer))
+    
+    def accepts_dir(self, rel):
+        return self.exclude is None or not self.exclude.match(rel)
+    
+    def accepts_file(self, rel):
+        if self.exclude is not None and self.exclude.match(rel):
+            return False
+        return self.include is None or self.include.match(rel) is not None
+    
+    def accepts_folder(self, root, path):
+        """Check a folder below root, and every folder on the way, against the exclusions."""
+        rel = os.path.relpath(path, root).replace(os.sep, '/').lower()
+        if rel == '.':
+            return True
+        parts = rel.split('/')
+        return all(self.accepts_dir('/'.join(parts[:n])) for n in range(1, len(parts) + 1))
+    
+    def accepts_path(self, root, path):
+        """Check a file below root against the rules, including every folder on the way."""
+        return self.accepts_folder(root, os.path.dirname(path)) and self.accepts_file(
+            os.path.relpath(path, root).replace(os.sep, '/').lower()
+        )
+    
+    def filter_directory(self, root, path, files, subdirs):
+        """Drop the listed files and subfolders of a folder below root that the rules exclude."""
+        rel = os.path.relpath(path, root).replace(os.sep, '/').lower()
+        prefix = '' if rel == '.' else rel + '/'
+        kept = []
+        for f in files:
+            rel = prefix + f[0].lower()
+            # Archives are filtered entry by entry, so only exclusions apply to them
+            if has_extension(f[0], (RPF_EXTENSION,)) and self.accepts_dir(rel) or self.accepts_file(rel):
+                kept.append(f)
+        subdirs = [d for d in subdirs if self.accepts_dir(prefix + os.path.basename(d).lower())]
+        return kept, subdirs
+    
+    def choose_keep(self, group, roots):
+        """Return the member of a scan_groups() group to keep, or None if no keep rule applies."""
+        members = group['members']
+        name = os.path.basename(members[0]['path'])
+        dot = name.rfind('.')
+        ext = name[dot:].lower() if dot > 0 else ''
+        for extensions, policies, prefer in self.keep:
+            if extensions is None or ext in extensions:
+                break
+        else:
+            return None
+        
+        def rank(member):
+            path = os.path.abspath(member['path'])
+            for i, folder in enumerate(prefer):
+                if path.startswith(folder.rstrip(os.sep) + os.sep):
+                    return i
+            return len(prefer)
+        
+        def sort_key(member):
+            key = []
+            for policy in policies:
+                if policy == 'preferred_root':
+                    key.append(rank(member))
+                elif policy == 'newest':
+                    key.append(-_member_mtime(member['path']))
+                else:
+                    key.append(len(os.path.relpath(member['path'], roots[member['root']])))
+            return key + [member['root'], member['path']]
+        
+        return min(members, key=sort_key)
+    
+    def mark_keep(self, group, roots):
+        """Flag the members of a group with 'keep' and return the kept one, or None if no keep rule applies."""
+        kept = self.choose_keep(group, roots)
+        if kept is not None:
+            for member in group['members']:
+                member['keep'] = member is kept
+        return kept
+
+
+def load_rules(path):
+    """Read a rules file. Raises ValueError if it is malformed."""
+    with open(path, encoding='utf-8') as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}") from None
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: a rules file holds a JSON object")
+    unknown = set(data) - set(RULES_KEYS)
+    if unknown:
+        raise ValueError(f"{path}: unknown key(s) {', '.join(sorted(unknown))}")
+    try:
+        return ScanRules(base=os.path.dirname(os.path.abspath(path)), **data)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError(f"{path}: {e}") from None
+
+
+# ===== CONTENT HASHING =====
+# Bytes read from the start and the end of a file for the partial hash
+PARTIAL_HASH_SIZE = 4096
+# Read size used when hashing whole files
+HASH_CHUNK_SIZE = 1024 * 1024
+# Files at least this large are hashed through mmap instead of read()
+MMAP_THRESHOLD = 64 * 1024 * 1024
+# Threads used for hashing; hashlib and file reads release the GIL
+HASH_WORKERS = os.cpu_count() or 1
+# Largest group of candidates compared side by side instead of hashed one by one
+COMPARE_MAX_FILES = 8
+# First read size of a side by side comparison, doubled up to the chunk size
+COMPARE_FIRST_CHUNK = 64 * 1024
+
+
+def new_hash():
+    """Return the hasher used for all content hashes."""
+    import hashlib
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_partial(path, size):
+    """Hash the first and last PARTIAL_HASH_SIZE bytes of a file."""
+    h = new_hash()
+    with open_source(path) as f:
+        if size <= PARTIAL_HASH_SIZE * 2:
+            h.update(f.read())
+            _count(files=1, open=1, read=1, bytes_read=size)
+        else:
+            h.update(f.read(PARTIAL_HASH_SIZE))
+            f.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+            h.update(f.read(PARTIAL_HASH_SIZE))
+            _count(files=1, open=1, read=2, bytes_read=PARTIAL_HASH_SIZE * 2)
+    return h.hexdigest()
+
+
+def _mappable(f):
+    """Return (file, start, prefix) of a source that can be memory mapped, or None."""
+    if isinstance(f, ArchiveEntryReader):
+        return f.file, f.offset, f.prefix
+    if isinstance(f, io.BufferedReader):
+        return f, 0, b''
+    return None
+
+
+def hash_full(path, chunk_size=HASH_CHUNK_SIZE):
+    """Hash the whole content of a file, holding at most one chunk in memory."""
+    h = new_hash()
+    with open_source(path) as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        mappable = _mappable(f) if size >= MMAP_THRESHOLD else None
+        if mappable is not None:
+            raw, start, prefix = mappable
+            h.update(prefix)
+            end = start + size - len(prefix)
+            with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m)
+                try:
+                    for offset in range(start, end, chunk_size):
+                        h.update(view[offset:min(offset + chunk_size, end)])
+                finally:
+                    view.release()
+            _count(files=1, open=1, mmap=1, bytes_read=size)
+        else:
+            reads = 0
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+                reads += 1
+            _count(files=1, open=1, read=reads + 1, bytes_read=size)
+    return h.hexdigest()
+
+
+def _spans_roots(members):
+    """Check if (root, info) members come from more than one root."""
+    first = members[0][0]
+    return any(root != first for root, _ in members)
+
+
+def _collisions(buckets):
+    """Yield (key, members) of buckets that still hold candidates from more than one root."""
+    for key, members in buckets.items():
+        if len(members) > 1 and _spans_roots(members):
+            yield key, members
+
+
+def _member_path(member):
+    return member[1].path
+
+
+def _advise_sequential(f, size):
+    """Tell the OS that a source will be read from start to end."""
+    mappable = _mappable(f) if hasattr(os, 'posix_fadvise') else None
+    if mappable is not None:
+        raw, start, prefix = mappable
+        try:
+            os.posix_fadvise(raw.fileno(), start, size - len(prefix), os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def compare_files(members, chunk_size=HASH_CHUNK_SIZE, keep=_spans_roots, progress=None):
+    """
+    Compare files of the same size by reading them side by side.
+    
+    members are (root, FileInfo) tuples. The files are read in lockstep,
+    starting with COMPARE_FIRST_CHUNK bytes and doubling up to chunk_size,
+    and split into classes whenever their bytes diverge. A class is dropped
+    as soon as it is down to one file or keep() rejects it, so files that
+    differ are settled after reading little of them. Returns (digest,
+    members) tuples of the classes identical to the end, digest being the
+    hash hash_full() gives, with members sorted by path.
+    """
+    total = sum(member[1].size for member in members)
+    read_bytes = reported = 0
+    reads = 0
+    sources = []
+    identical = []
+    try:
+        for member in members:
+            try:
+                f = open_source(member[1].path)
+            except (OSError, ValueError, zlib.error):
+                continue
+            sources.append((member, f))
+            _advise_sequential(f, member[1].size)
+        
+        classes = [(new_hash(), sources)]
+        size = min(COMPARE_FIRST_CHUNK, chunk_size)
+        while classes:
+            if progress is not None and progress.is_cancelled():
+                return []
+            split_classes = []
+            for h, group in classes:
+                # Candidates are grouped with the first one that read the same bytes
+                splits = []
+                for source in group:
+                    try:
+                        chunk = source[1].read(size)
+                    except (OSError, zlib.error):
+                        continue
+                    reads += 1
+                    read_bytes += len(chunk)
+                    for data, same in splits:
+                        if data == chunk:
+                            same.append(source)
+                            break
+                    else:
+                        splits.append((chunk, [source]))
+                
+                for data, same in splits:
+                    if len(same) < 2 or not keep([member for member, _ in same]):
+                        continue
+                    if not data:
+                        identical.append((h.hexdigest(), sorted((m for m, _ in same), key=_member_path)))
+                        continue
+                    same_h = h.copy()
+                    same_h.update(data)
+                    split_classes.append((same_h, same))
+            if progress is not None:
+                progress.add(bytes_hashed=read_bytes - reported)
+                reported = read_bytes
+            classes = split_classes
+            size = min(size * 2, chunk_size)
+    finally:
+        for _, f in sources:
+            f.close()
+        _count(files=len(sources), open=len(sources), read=reads, bytes_read=read_bytes)
+        if progress is not None:
+            # Bytes of files dropped early are never read
+            progress.add(bytes_hashed=read_bytes - reported, bytes_to_hash=read_bytes - total)
+    return identical
+
+
+def iter_content_duplicates(files, index=None, workers=HASH_WORKERS, chunk_size=HASH_CHUNK_SIZE,
+                            progress=None, headers=None, compare_limit=COMPARE_MAX_FILES):
+    """
+    Yield groups of files with identical content as soon as they are confirmed.
+    
+    files is a FileTable. Files are grouped by size first, then by a hash of
+    their head and tail, and only files that still collide are hashed in
+    full. Groups must contain files from at least two roots. Hashing runs on
+    a thread pool whose workers push results to a queue, and a group is
+    yielded once the last of its candidates is hashed. When a HashIndex is
+    given, hashes of unchanged files are taken from it and new hashes are
+    stored back.
+    
+    headers optionally maps file numbers to their ResourceHeader. Those files
+    are grouped by header instead of size and compared by their decompressed
+    payload, so the same resource saved with a different compression still
+    matches. Yields (size, digest, members) tuples where members are
+    (root, FileInfo) tuples sorted by path.
+    
+    Groups of up to compare_limit files whose full hashes are not all in
+    the index are read side by side with compare_files() instead, which
+    stops reading a file as soon as it differs from the others.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    def keys():
+        for i, size in enumerate(files.sizes):
+            header = headers.get(i) if headers else None
+            if header:
+                yield ('rsc7',) + header
+            else:
+                yield size or None
+    
+    by_key = files.bucket(keys())
+    if index is not None:
+        index.mark_seen(files.paths())
+    
+    # Only sizes (or resource headers) shared across roots need hashing at all
+    buckets = dict(files.collisions(by_key))
+    partial_left = {key: len(members) for key, members in buckets.items()}
+    partials = defaultdict(lambda: defaultdict(list))
+    full_left = {}
+    fulls = defaultdict(lambda: defaultdict(list))
+    
+    results = queue.Queue()
+    ready = deque()
+    outstanding = [0]
+    stop = threading.Event()
+    
+    def is_resource(key):
+        return isinstance(key, tuple)
+    
+    def cost(kind, size):
+        return min(size, PARTIAL_HASH_SIZE * 2) if kind == 0 else size
+    
+    def work(kind, member, key):
+        digest = None
+        try:
+            active = not stop.is_set() and not (progress is not None and progress.is_cancelled())
+            if active and kind == 2:
+                # member holds the whole group, compared side by side
+                digest = compare_files(member, chunk_size, progress=progress)
+            elif active:
+                info = member[1]
+                resource = is_resource(key if kind == 0 else key[0])
+                try:
+                    if resource:
+                        try:
+                            if kind == 0:
+                                digest = hash_resource_partial(info.path)
+                            else:
+                                digest = hash_resource(info.path, chunk_size)
+                        except zlib.error:
+                            # A payload that does not inflate still matches its byte-identical copies
+                            pass
+                    if digest is None and kind == 0:
+                        digest = hash_partial(info.path, info.size)
+                    elif digest is None:
+                        digest = hash_full(info.path, chunk_size)
+                finally:
+                    if progress is not None:
+                        progress.add(bytes_hashed=cost(kind, info.size))
+        except Exception:
+            # Unreadable files, or archives rewritten since the walk, just drop out
+            digest = None
+        finally:
+            # The consumer waits for one result per job, whatever happened
+            results.put((kind, member, key, digest))
+    
+    def cached_full(member):
+        cached = index.get(member[1])
+        return cached is not None and cached[1]
+    
+    def request(kind, member, key):
+        if kind == 2:
+            if progress is not None:
+                progress.add(bytes_to_hash=sum(m[1].size for m in member))
+            outstanding[0] += 1
+            pool.submit(work, kind, member, key)
+            return
+        root, info = member
+        # The index only holds byte hashes, not resource payload hashes
+        use_index = index is not None and not is_resource(key if kind == 0 else key[0])
+        cached = index.get(info) if use_index else None
+        if cached and cached[kind]:
+            ready.append((kind, member, key, cached[kind]))
+            return
+        if progress is not None:
+            progress.add(bytes_to_hash=cost(kind, info.size))
+        outstanding[0] += 1
+        pool.submit(work, kind, member, key)
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        try:
+            for key, members in buckets.items():
+                for member in members:
+                    request(0, member, key)
+            
+            while ready or outstanding[0]:
+                if progress is not None and progress.is_cancelled():
+                    break
+                if ready:
+                    kind, member, key, digest = ready.popleft()
+                else:
+                    kind, member, key, digest = results.get()
+                    outstanding[0] -= 1
+                
+                if kind == 0:
+                    resource = is_resource(key)
+                    if digest is not None:
+                        partials[key][digest].append(member)
+                        if index is not None and not resource:
+                            index.put(member[1], digest)
+                    partial_left[key] -= 1
+                    if partial_left[key]:
+                        continue
+                    
+                    for partial, same in _collisions(partials.pop(key, {})):
+                        # The partial hash already covered the whole file
+                        if not resource and key <= PARTIAL_HASH_SIZE * 2:
+                            yield key, partial, sorted(same, key=_member_path)
+                            continue
+                        if (not resource and len(same) <= compare_limit
+                                and (index is None or not all(cached_full(m) for m in same))):
+                            request(2, same, (key, partial))
+                            continue
+                        full_left[(key, partial)] = len(same)
+                        for m in same:
+                            request(1, m, (key, partial))
+                elif kind == 2:
+                    for full, same in digest or ():
+                        if index is not None:
+                            for m in same:
+                                index.put(m[1], key[1], full)
+                        yield key[0], full, same
+                else:
+                    if digest is not None:
+                        fulls[key][digest].append(member)
+                        if index is not None and not is_resource(key[0]):
+                            index.put(member[1], key[1], digest)
+                    full_left[key] -= 1
+                    if full_left[key]:
+                        continue
+                    
+                    for full, same in _collisions(fulls.pop(key, {})):
+                        same = sorted(same, key=_member_path)
+                        yield same[0][1].size, full, same
+        finally:
+            # Let queued jobs finish instantly if the caller stops early
+            stop.set()
+
+
+# ===== RAGE RESOURCES =====
+RSC7_MAGIC = b'RSC7'
+RSC7_HEADER_SIZE = 16
+
+# Version and page flags stored in the 16 byte header of RSC7 resources
+ResourceHeader = namedtuple('ResourceHeader', ['version', 'system_flags', 'graphics_flags'])
+
+
+def parse_resource_header(data):
+    """Parse an RSC7 header, or return None if data is not one."""
+    if len(data) < RSC7_HEADER_SIZE or data[:4] != RSC7_MAGIC:
+        return None
+    return ResourceHeader(*struct.unpack('<3I', data[4:RSC7_HEADER_SIZE]))
+
+
+def read_resource_header(path):
+    """Read the RSC7 header of a file, or None if it is not a resource."""
+    with open_source(path) as f:
+        _count(files=1, open=1, read=1, bytes_read=RSC7_HEADER_SIZE)
+        return parse_resource_header(f.read(RSC7_HEADER_SIZE))
+
+
+def read_resource_headers(files, workers=HASH_WORKERS, progress=None, batch_size=256):
+    """Read the headers of the files of a FileTable on a thread pool. Returns {file number: ResourceHeader}."""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    def read(start):
+        headers = []
+        for i in range(start, min(start + batch_size, len(files))):
+            if progress is not None and progress.is_cancelled():
+                break
+            if files.sizes[i] <= RSC7_HEADER_SIZE:
+                continue
+            try:
+                header = read_resource_header(files.path(i))
+            except OSError:
+                continue
+            if header is not None:
+                headers.append((i, header))
+        return headers
+    
+    # Batches keep the number of pending futures small on huge trees
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return {
+            i: header
+            for batch in pool.map(read, range(0, len(files), batch_size))
+            for i, header in batch
+        }
+
+
+def iter_resource_payload(path, chunk_size=HASH_CHUNK_SIZE):
+    """Yield the decompressed payload of an RSC7 resource in bounded chunks."""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    with open_source(path) as f:
+        _count(files=1, open=1)
+        f.seek(RSC7_HEADER_SIZE)
+        for data in iter(lambda: f.read(chunk_size), b''):
+            _count(read=1, bytes_read=len(data))
+            while data:
+                chunk = decompressor.decompress(data, chunk_size)
+                if chunk:
+                    yield chunk
+                data = decompressor.unconsumed_tail
+            if decompressor.eof:
+                break
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def hash_resource_partial(path):
+    """Hash the first decompressed bytes of an RSC7 resource."""
+    h = new_hash()
+    wanted = PARTIAL_HASH_SIZE * 2
+    for chunk in iter_resource_payload(path, wanted):
+        h.update(chunk[:wanted])
+        wanted -= len(chunk)
+        if wanted <= 0:
+            break
+    return h.hexdigest()
+
+
+def hash_resource(path, chunk_size=HASH_CHUNK_SIZE):
+    """Hash the header fields and decompressed payload of an RSC7 resource."""
+    header = read_resource_header(path)
+    if header is None:
+        raise OSError(f"Not an RSC7 resource: {path}")
+    h = new_hash()
+    h.update(struct.pack('<3I', *header))
+    for chunk in iter_resource_payload(path, chunk_size):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+# ===== RPF ARCHIVES =====
+RPF_EXTENSION = '.rpf'
+RPF7_MAGIC = 0x52504637
+RPF7_HEADER_SIZE = 16
+RPF7_ENTRY_SIZE = 16
+# Encryption field of archives whose TOC and entries are stored in the clear
+RPF_ENCRYPTION_NONE = 0
+RPF_ENCRYPTION_OPEN = 0x4E45504F
+RPF_DIRECTORY = 0x7FFFFF00
+RPF_BLOCK_SIZE = 512
+# Longest entry name accepted, the limit of common file systems
+RPF_MAX_NAME = 255
+
+# Where the bytes of an archive entry are. Resources are exposed as a
+# synthesized RSC7 header followed by stored_size bytes at offset; binary
+# files are raw deflate data when compressed, else stored as they are.
+ArchiveEntry = namedtuple('ArchiveEntry', ['offset', 'stored_size', 'size', 'compressed', 'header'])
+
+
+def read_archive(path):
+    """
+    Parse the table of contents of an RPF7 archive.
+    
+    Returns {inner path: ArchiveEntry} for every file, with inner paths
+    joined by os.sep. Raises ValueError for files that are not RPF7 and for
+    encrypted archives, which cannot be read without the game keys.
+    """
+    with open(path, 'rb') as f:
+        magic, count, names_length, encryption = struct.unpack('<4I', f.read(RPF7_HEADER_SIZE))
+        if magic != RPF7_MAGIC:
+            raise ValueError(f"Not an RPF7 archive: {path}")
+        if encryption not in (RPF_ENCRYPTION_NONE, RPF_ENCRYPTION_OPEN):
+            raise ValueError(f"Encrypted archive: {path}")
+        toc = f.read(count * RPF7_ENTRY_SIZE)
+        names = f.read(names_length)
+        _count(files=1, open=1, read=3, bytes_read=RPF7_HEADER_SIZE + len(toc) + len(names))
+        if len(toc) < count * RPF7_ENTRY_SIZE or len(names) < names_length:
+            raise ValueError(f"Truncated archive: {path}")
+        
+        def name_at(offset):
+            end = names.find(b'\0', offset)
+            return names[offset:end if end >= 0 else len(names)].decode('utf-8', 'replace')
+        
+        entries = {}
+        # Directories list their children as a contiguous run of entries
+        stack = [(0, '')]
+        visited = set()
+        while stack:
+            index, prefix = stack.pop()
+            if index in visited or index >= count:
+                continue
+            visited.add(index)
+            name_offset, ident, first, children = struct.unpack_from('<4I', toc, index * RPF7_ENTRY_SIZE)
+            if ident != RPF_DIRECTORY:
+                continue
+            for child in range(first, min(first + children, count)):
+                bits, word2, word3 = struct.unpack_from('<QII', toc, child * RPF7_ENTRY_SIZE)
+                name = name_at(bits & 0xFFFF)
+                if not name or len(name) > RPF_MAX_NAME:
+                    # Malformed name table; skip the entry and anything below it
+                    continue
+                inner = os.path.join(prefix, name) if prefix else name
+                if bits >> 32 == RPF_DIRECTORY:
+                    stack.append((child, inner))
+                    continue
+                
+                stored = (bits >> 16) & 0xFFFFFF
+                block = (bits >> 40) & 0xFFFFFF
+                if bits >> 63:
+                    # Resource: the flags carry the version, the data starts with an RSC7 header
+                    block &= 0x7FFFFF
+                    if stored == 0xFFFFFF:
+                        f.seek(block * RPF_BLOCK_SIZE)
+                        head = f.read(RSC7_HEADER_SIZE)
+                        if len(head) < RSC7_HEADER_SIZE:
+                            continue
+                        stored = head[7] | head[14] << 8 | head[5] << 16 | head[2] << 24
+                    if stored < RSC7_HEADER_SIZE:
+                        continue
+                    version = (word2 >> 28) << 4 | (word3 >> 28)
+                    header = struct.pack('<4s3I', RSC7_MAGIC, version, word2, word3)
+                    entries[inner] = ArchiveEntry(
+                        block * RPF_BLOCK_SIZE + RSC7_HEADER_SIZE, stored - RSC7_HEADER_SIZE,
+                        stored, False, header
+                    )
+                elif word3 == 0:
+                    # Binary file; word3 is its own encryption flag
+                    entries[inner] = ArchiveEntry(
+                        block * RPF_BLOCK_SIZE, stored or word2, word2, bool(stored), None
+                    )
+        return entries
+
+
+_archive_cache = {}
+_archive_cache_lock = threading.Lock()
+# Parsed TOCs kept in memory for reads of virtual files
+ARCHIVE_CACHE_SIZE = 64
+
+
+def archive_entries(path):
+    """read_archive() of an archive, cached until its size or mtime changes."""
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime_ns)
+    with _archive_cache_lock:
+        cached = _archive_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    entries = read_archive(path)
+    with _archive_cache_lock:
+        if len(_archive_cache) >= ARCHIVE_CACHE_SIZE:
+            _archive_cache.pop(next(iter(_archive_cache)))
+        _archive_cache[path] = (key, entries)
+    return entries
+
+
+def split_archive_path(path):
+    """Return (archive, inner path) if path points inside an .rpf archive, else None."""
+    lower = path.lower()
+    marker = RPF_EXTENSION + os.sep
+    start = 0
+    while True:
+        found = lower.find(marker, start)
+        if found < 0:
+            return None
+        archive = path[:found + len(RPF_EXTENSION)]
+        # Folders named like archives (e.g. extracted with CodeWalker) are real paths
+        if os.path.isfile(archive):
+            return archive, path[found + len(marker):]
+        start = found + 1
+
+
+class ArchiveEntryReader:
+    """Read-only, seekable file object over an uncompressed archive entry."""
+    
+    def __init__(self, path, entry):
+        self.file = open(path, 'rb')
+        self.prefix = entry.header or b''
+        self.offset = entry.offset
+        self.size = len(self.prefix) + entry.stored_size
+        self.pos = 0
+    
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.size - self.pos
+        n = max(0, min(n, self.size - self.pos))
+        data = self.prefix[self.pos:self.pos + n]
+        rest = n - len(data)
+        if rest:
+            self.file.seek(self.offset + self.pos + len(data) - len(self.prefix))
+            data += self.file.read(rest)
+        self.pos += len(data)
+        return data
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.pos, os.SEEK_END: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+    
+    def tell(self):
+        return self.pos
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CompressedEntryReader:
+    """
+    Read-only file object over a compressed archive entry, decompressed while it is read.
+    
+    Only the compressed chunk being decompressed and the bytes asked for
+    are held in memory. Seeking only moves the position; a read after a
+    forward seek decompresses and drops the bytes in between, and a read
+    before the current stream position starts over.
+    """
+    
+    def __init__(self, path, entry, chunk_size=HASH_CHUNK_SIZE):
+        self.file = open(path, 'rb')
+        self.offset = entry.offset
+        self.stored_size = entry.stored_size
+        self.size = entry.size
+        self.chunk_size = chunk_size
+        self.pos = 0
+        self.rewind()
+    
+    def rewind(self):
+        """Start decompressing from the beginning of the entry."""
+        self.file.seek(self.offset)
+        self.left = self.stored_size
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.stream_pos = 0
+    
+    def decompress(self, n):
+        """Return up to n more decompressed bytes, fewer only at the end of the stream."""
+        out = []
+        while n > 0 and not self.decompressor.eof:
+            data = self.decompressor.unconsumed_tail
+            if not data and self.left > 0:
+                data = self.file.read(min(self.left, self.chunk_size))
+                self.left = self.left - len(data) if data else 0
+            chunk = self.decompressor.decompress(data, n)
+            if not chunk and not data:
+                break
+            out.append(chunk)
+            n -= len(chunk)
+        data = b''.join(out)
+        self.stream_pos += len(data)
+        return data
+    
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.size - self.pos
+        n = max(0, min(n, self.size - self.pos))
+        if self.pos < self.stream_pos:
+            self.rewind()
+        while self.stream_pos < self.pos:
+            if not self.decompress(min(self.pos - self.stream_pos, self.chunk_size)):
+                return b''
+        data = self.decompress(n)
+        self.pos += len(data)
+        return data
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.pos, os.SEEK_END: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+    
+    def tell(self):
+        return self.pos
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_source(path):
+    """
+    Open a file for binary reading, also when it is an entry of an archive.
+    
+    Loose files are opened normally. Virtual paths below an .rpf archive
+    are read in place with seeks into the archive; compressed binary
+    entries are decompressed as they are read.
+    """
+    parts = split_archive_path(path)
+    if parts is None:
+        return open(path, 'rb')
+    archive, inner = parts
+    entry = archive_entries(archive).get(inner)
+    if entry is None:
+        raise FileNotFoundError(errno.ENOENT, "No such archive entry", path)
+    if not entry.compressed:
+        return ArchiveEntryReader(archive, entry)
+    return CompressedEntryReader(archive, entry)
+
+
+def add_archive(table, root, path, extensions, progress=None, rules=None, rule_root=None):
+    """
+    Add the entries of an archive to a FileTable as virtual files.
+    
+    Entries get the mtime and inode of the archive so the hash index drops
+    them when the archive changes. With ScanRules, entries are matched by
+    their path through the archive relative to rule_root, by default the
+    table root. Returns False if the archive could not be read, e.g.
+    because it is encrypted.
+    """
+    try:
+        st = os.stat(path)
+        entries = archive_entries(path)
+    except (OSError, ValueError, struct.error):
+        if progress is not None:
+            progress.add(archives_skipped=1)
+        return False
+    inode = st.st_ino if os.name != 'nt' else 0
+    by_dir = defaultdict(list)
+    root_path = table.roots[root] if rule_root is None else rule_root
+    for inner, entry in entries.items():
+        folder, _, name = inner.rpartition(os.sep)
+        if rules is not None and not rules.accepts_path(root_path, os.path.join(path, inner)):
+            continue
+        if has_extension(name, extensions):
+            by_dir[folder].append((name, entry.size, st.st_mtime_ns, inode))
+    for folder, files in by_dir.items():
+        table.add_directory(root, os.path.join(path, folder) if folder else path, files)
+        if progress is not None:
+            progress.add(files_walked=len(files))
+    return True
+
+
+# ===== NEAR DUPLICATES =====
+# Map files compared by archetype/entity features instead of bytes
+NEAR_EXTENSIONS = ('.ytyp', '.ymap')
+# Default estimated Jaccard similarity for near-duplicate pairs
+NEAR_THRESHOLD = 0.8
+# MinHash bins per signature; LSH splits them into bands of LSH_ROWS bins
+MINHASH_SIZE = 128
+LSH_ROWS = 4
+# Files with fewer features than this are too small to compare
+NEAR_MIN_FEATURES = 4
+# Largest decompressed payload read from a binary map file
+NEAR_MAX_PAYLOAD = 16 * 1024 * 1024
+
+_MERSENNE_61 = (1 << 61) - 1
+# Top bytes of little-endian floats in the range of coordinates and scales
+_FLOAT_TOP_BYTES = frozenset(range(0x3A, 0x49)) | frozenset(range(0xBA, 0xC9))
+
+
+def joaat(text):
+    """Jenkins one-at-a-time hash, used by the game for archetype names."""
+    h = 0
+    for byte in text.lower().encode('utf-8'):
+        h = (h + byte) & 0xFFFFFFFF
+        h = (h + (h << 10)) & 0xFFFFFFFF
+        h ^= h >> 6
+    h = (h + (h << 3)) & 0xFFFFFFFF
+    h ^= h >> 11
+    return (h + (h << 15)) & 0xFFFFFFFF
+
+
+def _name_hash(text):
+    """Hash of a name in CodeWalker XML, which writes unknown names as hash_XXXXXXXX."""
+    text = text.strip()
+    if text.lower().startswith('hash_'):
+        try:
+            return int(text[5:], 16)
+        except ValueError:
+            pass
+    return joaat(text)
+
+
+def xml_features(f):
+    """
+    Features of a map file exported to XML, read from a binary file object.
+    
+    Archetypes contribute the hash of their name, placed entities the hash
+    of their archetype name and rounded position, so moved props count as
+    changed entries.
+    """
+    from xml.etree import ElementTree
+    
+    features = set()
+    for elem in ElementTree.parse(f).iter('Item'):
+        name = elem.findtext('archetypeName')
+        position = elem.find('position')
+        if name and position is not None:
+            coords = ','.join(f"{float(position.get(axis, 0)):.1f}" for axis in 'xyz')
+            features.add(joaat(f"{name.strip()}@{coords}"))
+        elif elem.findtext('name'):
+            features.add(_name_hash(elem.findtext('name')))
+    _count(files=1, open=1, bytes_read=f.tell())
+    return features
+
+
+def binary_features(path):
+    """
+    Features of a binary map file: the hash-like 32-bit words of its payload.
+    
+    Archetype and asset names are stored as 32-bit name hashes, so the set
+    of aligned words that are neither small integers, resource pointers nor
+    coordinate floats is a cheap stand-in for the list of names, and does
+    not depend on the order of the entries.
+    """
+    if read_resource_header(path) is not None:
+        payload = bytearray()
+        for chunk in iter_resource_payload(path):
+            payload += chunk
+            if len(payload) >= NEAR_MAX_PAYLOAD:
+                break
+    else:
+        with open_source(path) as f:
+            payload = f.read(NEAR_MAX_PAYLOAD)
+            _count(files=1, open=1, read=1, bytes_read=len(payload))
+    words = array('I')
+    words.frombytes(bytes(payload[:len(payload) // 4 * 4]))
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return {
+        w for w in set(words)
+        if w > 0xFFFF and w >> 28 not in (5, 6) and w >> 24 not in _FLOAT_TOP_BYTES
+    }
+
+
+def extract_features(path):
+    """Return the feature set of a .ytyp/.ymap file, binary or XML."""
+    with open_source(path) as f:
+        head = f.read(64).lstrip()
+        if head.startswith(b'<') or head.startswith(b'\xef\xbb\xbf<'):
+            f.seek(0)
+            return xml_features(f)
+    return binary_features(path)
+
+
+def minhash(features, size=MINHASH_SIZE):
+    """
+    One-permutation MinHash signature of a set of integer features.
+    
+    Every feature is hashed once and only lowers the minimum of the bin it
+    falls into. Empty bins are densified by borrowing the next non-empty
+    bin to the right, offset by the distance, so small sets still give
+    comparable signatures.
+    """
+    bins = [None] * size
+    for feature in features:
+        h = (0x5851F42D4C957F2D * feature + 0x14057B7EF767814F) % _MERSENNE_61
+        b = h % size
+        value = h // size
+        if bins[b] is None or value < bins[b]:
+            bins[b] = value
+    if all(value is None for value in bins):
+        return None
+    offset = _MERSENNE_61 // size + 1
+    signature = list(bins)
+    for i in range(size):
+        if bins[i] is None:
+            distance = 1
+            while bins[(i + distance) % size] is None:
+                distance += 1
+            signature[i] = bins[(i + distance) % size] + distance * offset
+    return tuple(signature)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class LSHIndex:
+    """
+    Locality sensitive hashing over MinHash signatures.
+    
+    Signatures are cut into bands of rows bins; two files become candidates
+    when any band is identical, which happens with high probability above
+    roughly (1 / bands) ** (1 / rows) similarity. Only candidates are
+    compared, so the work grows with the number of similar files instead of
+    with the square of all files.
+    """
+    
+    def __init__(self, rows=LSH_ROWS):
+        self.rows = rows
+        self.buckets = {}
+    
+    def add(self, key, signature):
+        """Add a signature under an integer key and return the keys already sharing a band with it."""
+        candidates = set()
+        # Bands are keyed by their hash; a rare false candidate is dropped by the similarity check
+        bands = zip(*[iter(signature)] * self.rows)
+        for band_key in map(hash, enumerate(bands)):
+            bucket = self.buckets.get(band_key)
+            if bucket is None:
+                self.buckets[band_key] = key
+            elif isinstance(bucket, int):
+                self.buckets[band_key] = [bucket, key]
+                candidates.add(bucket)
+            else:
+                candidates.update(bucket)
+                bucket.append(key)
+        return candidates
+
+
+def iter_near_duplicates(files, threshold=NEAR_THRESHOLD, workers=HASH_WORKERS, progress=None, batch_size=64):
+    """
+    Yield (similarity, member1, member2) for near-duplicate map files.
+    
+    files is a FileTable; only .ytyp/.ymap files are used. Features are
+    extracted and fingerprinted on a thread pool and pairs are found
+    through an LSHIndex. Pairs must span two roots and are yielded as
+    (root, FileInfo) members in root order, most similar first per file.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    ids = [
+        i for i in range(len(files))
+        if has_extension(files.name(i), NEAR_EXTENSIONS) and files.sizes[i] > 0
+    ]
+    if progress is not None:
+        progress.add(bytes_to_hash=sum(files.sizes[i] for i in ids))
+    
+    def fingerprint(batch):
+        signatures = []
+        for i in batch:
+            if progress is not None and progress.is_cancelled():
+                break
+            try:
+                features = extract_features(files.path(i))
+            except (OSError, zlib.error, SyntaxError, ValueError):
+                features = None
+            if features and len(features) >= NEAR_MIN_FEATURES:
+                signatures.append((i, minhash(features)))
+            if progress is not None:
+                progress.add(bytes_hashed=files.sizes[i])
+        return signatures
+    
+    index = LSHIndex()
+    signatures = {}
+    batches = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for batch in pool.map(fingerprint, batches):
+            for i, signature in batch:
+                matches = []
+                for j in index.add(i, signature):
+                    if files.root(j) == files.root(i):
+                        continue
+                    score = similarity(signature, signatures[j])
+                    if score >= threshold:
+                        matches.append((score, j))
+                signatures[i] = signature
+                for score, j in sorted(matches, reverse=True):
+                    pair = sorted([files.entry(i), files.entry(j)], key=lambda m: m[0])
+                    yield score, pair[0], pair[1]
+
+
+# ===== HASH INDEX =====
+INDEX_FILENAME = 'duplicate_finder_index.db'
+
+
+def get_app_dir():
+    """Return the folder holding the script or the frozen executable."""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+class HashIndex:
+    """
+    Persistent SQLite cache of file hashes.
+    
+    Rows are keyed by path and are only trusted while the size, mtime and
+    inode of the file are unchanged. Rows are loaded per root into memory
+    when a scan starts and written back in one transaction by save().
+    """
+    
+    def __init__(self, db_path=None):
+        import sqlite3
+        self.db_path = db_path or os.path.join(get_app_dir(), INDEX_FILENAME)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "inode INTEGER, partial_hash TEXT, full_hash TEXT)"
+        )
+        self.rows = {}
+        self.dirty = {}
+        self.seen = set()
+        self.removed = set()
+        self.loaded_roots = []
+    
+    def load(self, root):
+        """Load all rows under a root folder into memory."""
+        root = os.path.normpath(os.path.abspath(root))
+        prefix = root.rstrip(os.sep) + os.sep
+        # Every path under prefix sorts between prefix and prefix with its last char bumped
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        cursor = self.conn.execute(
+            "SELECT path, size, mtime_ns, inode, partial_hash, full_hash "
+            "FROM files WHERE path >= ? AND path < ?",
+            (prefix, upper)
+        )
+        for path, size, mtime_ns, inode, partial, full in cursor:
+            self.rows[path] = (size, mtime_ns, inode, partial, full)
+        self.loaded_roots.append(prefix)
+    
+    def mark_seen(self, paths):
+        """Mark paths found by the current scan so save() keeps their rows."""
+        self.seen.update(os.path.abspath(p) for p in paths)
+    
+    def get(self, info):
+        """Return (partial, full) for an unchanged FileInfo, or None."""
+        row = self.rows.get(os.path.abspath(info.path))
+        if row is None or row[:3] != (info.size, info.mtime_ns, info.inode):
+            return None
+        return row[3], row[4]
+    
+    def put(self, info, partial, full=None):
+        """Record the hashes of a FileInfo."""
+        key = os.path.abspath(info.path)
+        old = self.rows.get(key)
+        if full is None and old is not None and old[:4] == (info.size, info.mtime_ns, info.inode, partial):
+            full = old[4]
+        row = (info.size, info.mtime_ns, info.inode, partial, full)
+        # A file forgotten and hashed again, e.g. on a watch update, is back
+        self.removed.discard(key)
+        if row == old:
+            return
+        self.rows[key] = row
+        self.dirty[key] = row
+    
+    def forget(self, paths):
+        """Drop the rows of files known to be removed."""
+        for path in paths:
+            key = os.path.abspath(path)
+            self.seen.discard(key)
+            self.dirty.pop(key, None)
+            if self.rows.pop(key, None) is not None:
+                self.removed.add(key)
+    
+    def save(self):
+        """Write changed rows and drop rows of files that no longer exist."""
+        gone = [
+            (path,) for path in self.rows
+            if path not in self.seen and not os.path.exists(path)
+        ]
+        gone.extend((path,) for path in self.removed)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                [(path,) + row for path, row in self.dirty.items()]
+            )
+            self.conn.executemany("DELETE FROM files WHERE path = ?", gone)
+        for (path,) in gone:
+            self.rows.pop(path, None)
+        self.dirty.clear()
+        self.removed.clear()
+    
+    def close(self):
+        self.conn.close()
+
+
+def open_index(roots, db_path=None):
+    """Open the hash index and load the given roots, or return None if unavailable."""
+    import sqlite3
+    try:
+        index = HashIndex(db_path)
+        for root in roots:
+            index.load(root)
+    except (sqlite3.Error, OSError):
+        return None
+    return index
+
+
+# ===== SCAN CORE =====
+DEFAULT_EXTENSIONS = ('.ycd', '.ydr', '.ytyp', '.ybn')
+
+
+def check_roots(roots):
+    """
+    Raise ValueError if a folder is given twice or lies inside another one.
+    
+    Folders are compared by their real path, so a symlink to a folder
+    counts as that folder. Overlapping folders would list the same file
+    as a duplicate of itself.
+    """
+    real = [os.path.realpath(root) for root in roots]
+    for i in range(len(roots)):
+        for j in range(i):
+            if real[i] == real[j]:
+                raise ValueError(f"Folder given twice: {roots[j]} and {roots[i]}")
+            for inner, outer in ((i, j), (j, i)):
+                if real[inner].startswith(real[outer].rstrip(os.sep) + os.sep):
+                    raise ValueError(f"Folder {roots[inner]} is inside {roots[outer]}")
+
+
+def distinct_members(members):
+    """
+    List (root, FileInfo) members that resolve to the same file only once.
+    
+    Of a file reached through symlinks, the member at its real path is
+    kept, otherwise the first one.
+    """
+    chosen = {}
+    for member in members:
+        path = member[1].path
+        real = os.path.realpath(path)
+        if real not in chosen or os.path.abspath(path) == real:
+            chosen[real] = member
+    kept = {id(member) for member in chosen.values()}
+    return [member for member in members if id(member) in kept]
+
+
+class DuplicatePair:
+    """
+    A file of folder 1 and its duplicate in folder 2.
+    
+    Uses __slots__ since the GUI keeps every pair of a scan in memory.
+    Fields can also be read like dict keys, e.g. dup['path1']. similarity
+    is only set for near duplicates and left out of as_dict() otherwise.
+    """
+    
+    __slots__ = ('filename', 'path1', 'path2', 'size', 'similarity')
+    
+    def __init__(self, filename, path1, path2, size, similarity=None):
+        self.filename = filename
+        self.path1 = path1
+        self.path2 = path2
+        self.size = size
+        self.similarity = similarity
+    
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def as_dict(self):
+        record = {field: getattr(self, field) for field in self.__slots__}
+        if self.similarity is None:
+            del record['similarity']
+        return record
+
+
+class DuplicateScanner:
+    """
+    Find duplicate files between folders without any UI.
+    
+    scan_groups() takes any number of folders and yields duplicate groups as
+    dicts with 'key' (filename, content hash, or estimated similarity of a
+    near-duplicate pair), 'size' (total bytes) and 'members' keys. Each member is a dict with the index of its folder in
+    'root', its 'path' and its 'size'. group_pairs() turns a group of two
+    folders into the DuplicatePair records shown by the GUI.
+    Results are yielded as soon as they are confirmed; progress holds the
+    counters of the running scan and cancel() stops it. An optional
+    ScanProfiler records the time and I/O of every stage. With archives,
+    entries of .rpf archives take part as virtual files read in place.
+    ScanRules limit the walk to the files and folders they accept.
+    """
+    
+    def __init__(self, extensions=DEFAULT_EXTENSIONS, match_mode="name", use_index=False,
+                 index_path=None, scan_workers=SCAN_WORKERS, hash_workers=HASH_WORKERS,
+                 chunk_size=HASH_CHUNK_SIZE, profiler=None, near_threshold=NEAR_THRESHOLD, archives=False,
+                 rules=None):
+        self.extensions = {ext.lower() for ext in extensions}
+        self.match_mode = match_mode
+        self.use_index = use_index
+        self.index_path = index_path
+        self.scan_workers = scan_workers
+        self.hash_workers = hash_workers
+        self.chunk_size = chunk_size
+        self.progress = ScanProgress()
+        self.profiler = profiler
+        self.near_threshold = near_threshold
+        self.archives = archives
+        self.rules = rules
+    
+    def set_stage(self, stage, threads=1):
+        self.progress.set_stage(stage)
+        if self.profiler is not None:
+            self.profiler.begin(stage, threads)
+    
+    def cancel(self):
+        """Ask the running scan to stop."""
+        self.progress.cancel()
+    
+    def scan_groups(self, roots):
+        """
+        Yield groups of duplicates spanning at least two of the given folders.
+        
+        Raises ValueError if the folders overlap (see check_roots()).
+        """
+        check_roots(roots)
+        if self.profiler is not None:
+            self.profiler.activate()
+        try:
+            # One walk per root, all roots at the same time
+            self.set_stage('walk', self.scan_workers)
+            files = walk_roots(roots, self.extensions, self.scan_workers, self.progress, self.archives, self.rules)
+            
+            if self.match_mode in ("content", "structure"):
+                yield from self.find_content_groups(roots, files)
+            elif self.match_mode == "near":
+                self.set_stage('hash', self.hash_workers)
+                pairs = iter_near_duplicates(files, self.near_threshold, self.hash_workers, self.progress)
+                for score, member1, member2 in pairs:
+                    group = self.make_group(round(score, 3), [member1, member2])
+                    if group is not None:
+                        yield group
+            else:
+                self.set_stage('match')
+                by_name = files.bucket(name.lower() for name in files.names())
+                
+                for filename, members in files.collisions(by_name):
+                    if self.progress.is_cancelled():
+                        break
+                    group = self.make_group(filename, sorted(members, key=_member_path))
+                    if group is not None:
+                        yield group
+            self.progress.set_stage('done')
+        finally:
+            if self.profiler is not None:
+                self.profiler.deactivate()
+    
+    def find_content_groups(self, roots, files):
+        """Yield groups of files with identical content."""
+        headers = None
+        if self.match_mode == "structure":
+            # 16 byte RSC7 headers rule out most resources before any hashing
+            self.set_stage('headers', self.hash_workers)
+            headers = read_resource_headers(files, self.hash_workers, self.progress)
+        
+        self.set_stage('hash', self.hash_workers)
+        index = open_index(roots, self.index_path) if self.use_index else None
+        try:
+            groups = iter_content_duplicates(
+                files, index, self.hash_workers, self.chunk_size, self.progress, headers
+            )
+            for size, digest, members in groups:
+                group = self.make_group(digest, members)
+                if group is not None:
+                    yield group
+            if index is not None:
+                index.save()
+        finally:
+            if index is not None:
+                index.close()
+    
+    def make_group(self, key, members):
+        """
+        Build a group dict from (root, FileInfo) members.
+        
+        Paths resolving to the same file are listed once. Returns None if
+        the remaining members no longer span two folders.
+        """
+        members = distinct_members(members)
+        if len({i for i, _ in members}) < 2:
+            return None
+        self.progress.add(groups_found=1)
+        return {
+            'key': key,
+            'size': sum(info.size for _, info in members),
+            'members': [
+                {'root': i, 'path': info.path, 'size': info.size}
+                for i, info in members
+            ]
+        }
+    
+    def group_pairs(self, group):
+        """
+        Yield the two-folder records of a group found by scan_groups([path1, path2]).
+        
+        Every member of both folders shows up in at least one pair: the
+        members of each folder are paired in order and the last member of
+        the smaller side is repeated.
+        """
+        members1 = [m for m in group['members'] if m['root'] == 0]
+        paths2 = [m['path'] for m in group['members'] if m['root'] == 1]
+        similarity = group['key'] if self.match_mode == "near" else None
+        for k in range(max(len(members1), len(paths2))):
+            member = members1[min(k, len(members1) - 1)]
+            if self.match_mode != "name":
+                filename = os.path.basename(member['path'])
+            else:
+                filename = group['key']
+            yield DuplicatePair(filename, member['path'], paths2[min(k, len(paths2) - 1)], member['size'], similarity)
+
+
+# ===== WATCH MODE =====
+# Seconds to wait for more events before a burst of changes is evaluated
+WATCH_SETTLE = 0.5
+# Longest a burst is collected before it is evaluated, even if events keep coming
+WATCH_MAX_SETTLE = 5.0
+# Seconds between two walks of the polling fallback
+POLL_INTERVAL = 5.0
+
+
+def stat_info(path, st):
+    """FileInfo of an os.stat() result, matching what the directory walk records."""
+    # DirEntry.stat() leaves st_ino unset on Windows; keep both sources comparable
+    return FileInfo(path, st.st_size, st.st_mtime_ns, st.st_ino if os.name != 'nt' else 0)
+
+
+class InotifySource:
+    """
+    Report changed paths under some folders from Linux inotify events.
+    
+    Every directory gets a watch, added again for directories created or
+    moved in later. wait() returns the set of changed file and directory
+    paths, or the roots themselves if the kernel event queue overflowed.
+    Raises OSError if inotify is unavailable or the watch limit is reached.
+    """
+    
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT = struct.Struct('iIII')
+    
+    def __init__(self, roots):
+        import ctypes
+        import ctypes.util
+        
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.roots = list(roots)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            self.raise_errno()
+        self.watches = {}
+        try:
+            for root in self.roots:
+                self.add_tree(root)
+        except OSError:
+            self.close()
+            raise
+    
+    def raise_errno(self, path=None):
+        err = self.ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+    
+    def add_tree(self, path):
+        """Watch a directory and every directory below it."""
+        stack = [path]
+        while stack:
+            folder = stack.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK)
+            if wd < 0:
+                # Folders may vanish or be unreadable; running out of watches is fatal
+                if self.ctypes.get_errno() == errno.ENOSPC:
+                    self.raise_errno(folder)
+                continue
+            self.watches[wd] = folder
+            try:
+                with os.scandir(folder) as it:
+                    stack.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+    
+    def remove_tree(self, path):
+        """Drop the watches of a directory that was moved away."""
+        prefix = path + os.sep
+        for wd, folder in list(self.watches.items()):
+            if folder == path or folder.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+    
+    def read(self, timeout):
+        """Read the pending events, waiting up to timeout seconds for the first one."""
+        changes = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changes
+        data = os.read(self.fd, 256 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b'\0')
+            offset += self.EVENT.size + length
+            
+            if mask & self.IN_Q_OVERFLOW:
+                changes.update(self.roots)
+                continue
+            folder = self.watches.get(wd)
+            if folder is None:
+                continue
+            if mask & self.IN_IGNORED:
+                del self.watches[wd]
+                continue
+            path = os.path.join(folder, os.fsdecode(name)) if name else folder
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    try:
+                        self.add_tree(path)
+                    except OSError:
+                        pass
+                elif mask & self.IN_MOVED_FROM:
+                    self.remove_tree(path)
+                elif not mask & self.IN_DELETE:
+                    continue
+            changes.add(path)
+        return changes
+    
+    def wait(self, timeout, progress=None):
+        """
+        Return the paths changed by the next burst of events, or an empty set after timeout.
+        
+        A burst ends after WATCH_SETTLE seconds without events, after
+        WATCH_MAX_SETTLE seconds at most, or when progress is cancelled.
+        """
+        changes = self.read(timeout)
+        deadline = time.monotonic() + WATCH_MAX_SETTLE
+        while changes and time.monotonic() < deadline:
+            if progress is not None and progress.is_cancelled():
+                break
+            more = self.read(WATCH_SETTLE)
+            if not more:
+                break
+            changes |= more
+        return changes
+    
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingSource:
+    """
+    Report changed files by walking the folders every interval seconds.
+    
+    Fallback for systems without inotify. Each poll costs a walk of the
+    whole tree, but only the files whose stat data changed are reported.
+    Folders excluded by ScanRules are not walked.
+    """
+    
+    def __init__(self, roots, extensions, interval=POLL_INTERVAL, workers=SCAN_WORKERS, rules=None):
+        self.roots = list(roots)
+        self.extensions = extensions
+        self.interval = interval
+        self.workers = workers
+        self.rules = rules
+        self.snapshot = self.take()
+        self.next_poll = time.monotonic() + interval
+    
+    def take(self):
+        files = walk_roots(self.roots, self.extensions, self.workers, rules=self.rules)
+        return {
+            path: (files.sizes[i], files.mtimes[i], files.inodes[i])
+            for i, path in enumerate(files.paths())
+        }
+    
+    def wait(self, timeout, progress=None):
+        remaining = self.next_poll - time.monotonic()
+        if remaining > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(0, remaining))
+        snapshot = self.take()
+        self.next_poll = time.monotonic() + self.interval
+        old, self.snapshot = self.snapshot, snapshot
+        return {path for path in old.keys() | snapshot.keys() if old.get(path) != snapshot.get(path)}
+    
+    def close(self):
+        pass
+
+
+def open_watch_source(roots, extensions, poll_interval=None, workers=SCAN_WORKERS, rules=None):
+    """Return an InotifySource, or a PollingSource if inotify is unavailable or polling is asked for."""
+    if poll_interval is None and sys.platform.startswith('linux'):
+        try:
+            return InotifySource(roots)
+        except (OSError, AttributeError):
+            pass
+    return PollingSource(roots, extensions, poll_interval or POLL_INTERVAL, workers, rules)
+
+
+class DuplicateWatcher:
+    """
+    Keep the duplicate groups of some folders up to date while files change.
+    
+    start() walks the folders once and finds all groups like a scan. After
+    that, apply() only looks at the changed paths: their buckets (filename,
+    size or resource header, depending on the scanner match mode) are
+    re-evaluated and hashes of unchanged files come from the hash index, so
+    the cost depends on the size of the change rather than of the tree.
+    Both yield events as dicts with 'event' ('added', 'changed' or
+    'removed'), the current 'group' and the 'previous' one, if any.
+    names and sizes map lowercase filenames and file sizes to the paths
+    of the known files, for lookups.
+    """
+    
+    def __init__(self, scanner, roots):
+        self.scanner = scanner
+        self.roots = [os.path.normpath(root) for root in roots]
+        self.files = {}
+        self.names = defaultdict(set)
+        self.sizes = defaultdict(set)
+        self.dir_files = defaultdict(set)
+        self.keys = {}
+        self.buckets = defaultdict(set)
+        self.groups = defaultdict(dict)
+        self.index = None
+        self.persistent = False
+    
+    def source_extensions(self):
+        """Extensions an event source has to report; archives are re-read as a whole."""
+        if self.scanner.archives:
+            return self.scanner.extensions | {RPF_EXTENSION}
+        return self.scanner.extensions
+    
+    def root_of(self, path):
+        for i, root in enumerate(self.roots):
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return i
+        return None
+    
+    def bucket_key(self, info, header=None):
+        """Key of the bucket a file is compared in, or None if it never matches."""
+        if self.scanner.match_mode == "name":
+            return os.path.basename(info.path).lower()
+        if not info.size:
+            return None
+        if header is None and self.scanner.match_mode == "structure" and info.size > RSC7_HEADER_SIZE:
+            try:
+                header = read_resource_header(info.path)
+            except OSError:
+                pass
+        return ('rsc7',) + tuple(header) if header else info.size
+    
+    def add(self, root, info, key, touched):
+        path = info.path
+        self.files[path] = (root, info)
+        self.names[os.path.basename(path).lower()].add(path)
+        self.sizes[info.size].add(path)
+        self.dir_files[os.path.dirname(path)].add(path)
+        if key is not None:
+            self.keys[path] = key
+            self.buckets[key].add(path)
+            touched.add(key)
+    
+    def remove(self, path, touched):
+        known = self.files.pop(path, None)
+        if known is None:
+            return
+        for lookup, key in ((self.names, os.path.basename(path).lower()), (self.sizes, known[1].size)):
+            lookup[key].discard(path)
+            if not lookup[key]:
+                del lookup[key]
+        folder = os.path.dirname(path)
+        self.dir_files[folder].discard(path)
+        if not self.dir_files[folder]:
+            del self.dir_files[folder]
+        key = self.keys.pop(path, None)
+        if key is not None:
+            self.buckets[key].discard(path)
+            if not self.buckets[key]:
+                del self.buckets[key]
+            touched.add(key)
+        if self.index is not None:
+            self.index.forget([path])
+    
+    def remove_tree(self, path, touched, keep=()):
+        """Remove known files below a directory, except the paths in keep."""
+        prefix = path + os.sep
+        for folder in [d for d in self.dir_files if d == path or d.startswith(prefix)]:
+            for file_path in list(self.dir_files[folder]):
+                if file_path not in keep:
+                    self.remove(file_path, touched)
+    
+    def update(self, root, info, touched):
+        old = self.files.get(info.path)
+        if old is not None and old[1] == info:
+            return
+        self.remove(info.path, touched)
+        self.add(root, info, self.bucket_key(info), touched)
+    
+    def start(self):
+        """Walk the folders and yield an 'added' event for every group. Raises ValueError for overlapping folders."""
+        check_roots(self.roots)
+        scanner = self.scanner
+        if scanner.use_index:
+            self.index = open_index(self.roots, scanner.index_path)
+            self.persistent = self.index is not None
+        if self.index is None:
+            # Hashes still have to outlive a single update to keep updates cheap
+            self.index = HashIndex(':memory:')
+        
+        scanner.set_stage('walk', scanner.scan_workers)
+        files = walk_roots(
+            self.roots, scanner.extensions, scanner.scan_workers, scanner.progress, scanner.archives, scanner.rules
+        )
+        headers = {}
+        if scanner.match_mode == "structure":
+            scanner.set_stage('headers', scanner.hash_workers)
+            headers = read_resource_headers(files, scanner.hash_workers, scanner.progress)
+        touched = set()
+        for i in range(len(files)):
+            info = files.info(i)
+            self.add(files.root(i), info, self.bucket_key(info, headers.get(i)), touched)
+        
+        yield from self.evaluate(touched)
+        if self.persistent:
+            self.index.save()
+        scanner.set_stage('watch')
+    
+    def apply(self, paths):
+        """Re-evaluate changed files or directories and yield the resulting events."""
+        rules = self.scanner.rules
+        touched = set()
+        for path in paths:
+            path = os.path.normpath(path)
+            root = self.root_of(path)
+            if root is None:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            
+            found = None
+            if st is not None and stat.S_ISDIR(st.st_mode):
+                if rules is not None and not rules.accepts_folder(self.roots[root], path):
+                    # Excluded folders are not walked; nothing below them is kept
+                    found = FileTable([path])
+                else:
+                    # A directory moved in, or a burst the event source could not itemize
+                    found = walk_roots(
+                        [path], self.scanner.extensions, self.scanner.scan_workers, archives=self.scanner.archives,
+                        rules=rules, rule_roots=[self.roots[root]]
+                    )
+            elif st is not None and self.scanner.archives and has_extension(path, (RPF_EXTENSION,)):
+                found = FileTable([path])
+                add_archive(found, 0, path, self.scanner.extensions, rules=rules, rule_root=self.roots[root])
+            
+            if found is not None:
+                infos = [found.info(i) for i in range(len(found))]
+                self.remove_tree(path, touched, keep={info.path for info in infos})
+                for info in infos:
+                    self.update(root, info, touched)
+            elif st is not None and stat.S_ISREG(st.st_mode) \
+                    and has_extension(os.path.basename(path), self.scanner.extensions) \
+                    and (rules is None or rules.accepts_path(self.roots[root], path)):
+                self.update(root, stat_info(path, st), touched)
+            else:
+                self.remove(path, touched)
+                self.remove_tree(path, touched)
+        
+        yield from self.evaluate(touched)
+    
+    def evaluate(self, keys):
+        """Recompute the groups of the given buckets and yield what changed."""
+        scanner = self.scanner
+        found = defaultdict(dict)
+        spanning = [
+            key for key in keys
+            if len({self.files[p][0] for p in self.buckets.get(key, ())}) > 1
+        ]
+        
+        if scanner.match_mode == "name":
+            for key in spanning:
+                members = sorted((self.files[p] for p in self.buckets[key]), key=_member_path)
+                group = scanner.make_group(key, members)
+                if group is not None:
+                    found[key][key] = group
+        elif spanning:
+            table = FileTable(self.roots)
+            by_dir = defaultdict(list)
+            for key in spanning:
+                for path in self.buckets[key]:
+                    root, info = self.files[path]
+                    by_dir[(root, os.path.dirname(path))].append(
+                        (os.path.basename(path), info.size, info.mtime_ns, info.inode)
+                    )
+            for (root, folder), files in by_dir.items():
+                table.add_directory(root, folder, files)
+            headers = {
+                i: self.keys[path][1:]
+                for i, path in enumerate(table.paths()) if isinstance(self.keys[path], tuple)
+            }
+            groups = iter_content_duplicates(
+                table, self.index, scanner.hash_workers, scanner.chunk_size, scanner.progress, headers
+            )
+            for size, digest, members in groups:
+                group = scanner.make_group(digest, members)
+                if group is not None:
+                    found[self.keys[members[0][1].path]][digest] = group
+        
+        for key in keys:
+            old = self.groups.pop(key, {})
+            new = found.get(key, {})
+            if new:
+                self.groups[key] = new
+            for group_key, group in new.items():
+                previous = old.get(group_key)
+                if previous is None:
+                    yield {'event': 'added', 'group': group, 'previous': None}
+                elif [m['path'] for m in previous['members']] != [m['path'] for m in group['members']] \
+                        or previous['size'] != group['size']:
+                    yield {'event': 'changed', 'group': group, 'previous': previous}
+            for group_key, previous in old.items():
+                if group_key not in new:
+                    yield {'event': 'removed', 'group': previous, 'previous': previous}
+    
+    def current_groups(self):
+        """Yield all current groups."""
+        for groups in self.groups.values():
+            yield from groups.values()
+    
+    def watch(self, source, emit, timeout=1.0):
+        """Pass the events of every change reported by source to emit() until the scanner is cancelled."""
+        while not self.scanner.progress.is_cancelled():
+            changes = source.wait(timeout, self.scanner.progress)
+            if changes:
+                events = list(self.apply(changes))
+                if events:
+                    emit(events)
+    
+    def close(self):
+        if self.index is not None:
+            if self.persistent:
+                self.index.save()
+            self.index.close()
+            self.index = None
+
+
+# ===== QUERY SERVER =====
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+# Seconds a client waits for an answer
+QUERY_TIMEOUT = 30.0
+
+
+class DuplicateServer:
+    """
+    Answer duplicate queries over HTTP from one warm, watched file list.
+    
+    The folders are walked once by a DuplicateWatcher and then kept up to
+    date from change events, so clients on other machines get answers
+    without walking the tree themselves. Lookups by filename come straight
+    from memory. Lookups by content only read the files of the same size
+    whose hashes are not in the hash index yet, and compare the head and
+    tail hash first when the client sends it. lock guards the watcher,
+    which is updated by the thread running run() while requests are
+    answered on others.
+    """
+    
+    def __init__(self, scanner, roots):
+        self.scanner = scanner
+        self.watcher = DuplicateWatcher(scanner, roots)
+        self.lock = threading.Lock()
+        self.updates = 0
+    
+    def start(self):
+        """Walk the folders; lookups are answered once this returns."""
+        with self.lock:
+            for _ in self.watcher.start():
+                pass
+    
+    def run(self, source, timeout=1.0):
+        """Apply the changes reported by source until the scanner is cancelled."""
+        while not self.scanner.progress.is_cancelled():
+            changes = source.wait(timeout, self.scanner.progress)
+            if changes:
+                with self.lock:
+                    for _ in self.watcher.apply(changes):
+                        pass
+                    self.updates += 1
+    
+    def member(self, root, info):
+        return {'root': self.watcher.roots[root], 'path': info.path, 'size': info.size}
+    
+    def status(self):
+        with self.lock:
+            return {
+                'roots': self.watcher.roots,
+                'match': self.scanner.match_mode,
+                'files': len(self.watcher.files),
+                'groups': sum(len(groups) for groups in self.watcher.groups.values()),
+                'updates': self.updates,
+            }
+    
+    def groups(self):
+        with self.lock:
+            groups = list(self.watcher.current_groups())
+        return [
+            dict(group, members=[dict(m, root=self.watcher.roots[m['root']]) for m in group['members']])
+            for group in groups
+        ]
+    
+    def find_name(self, name):
+        """Files named name, in any case."""
+        with self.lock:
+            found = [self.watcher.files[path] for path in self.watcher.names.get(name.lower(), ())]
+        return [self.member(root, info) for root, info in sorted(found, key=_member_path)]
+    
+    def find_content(self, size, digest, partial=None):
+        """Files whose full content hash is digest; partial, if given, rules most others out cheaply."""
+        watcher = self.watcher
+        if not size:
+            # Empty files are never duplicates, as in a scan
+            return []
+        with self.lock:
+            candidates = []
+            for path in watcher.sizes.get(size, ()):
+                root, info = watcher.files[path]
+                candidates.append((root, info, watcher.index.get(info) or (None, None)))
+        
+        found = []
+        hashed = []
+        for root, info, (cached_partial, full) in candidates:
+            try:
+                if cached_partial is None:
+                    cached_partial = hash_partial(info.path, info.size)
+                    hashed.append((info, cached_partial, None))
+                # Small files are read whole by the partial hash
+                if size <= PARTIAL_HASH_SIZE * 2:
+                    full = cached_partial
+                elif partial is not None and cached_partial != partial:
+                    continue
+                if full is None:
+                    full = hash_full(info.path, self.scanner.chunk_size)
+                    hashed.append((info, cached_partial, full))
+            except (OSError, ValueError):
+                continue
+            if full == digest:
+                found.append((root, info))
+        
+        if hashed:
+            with self.lock:
+                for info, cached_partial, full in hashed:
+                    # Skip files that changed or were removed while they were hashed
+                    if watcher.files.get(info.path, (None, None))[1] == info:
+                        watcher.index.put(info, cached_partial, full)
+        return [self.member(root, info) for root, info in sorted(found, key=_member_path)]
+    
+    def close(self):
+        with self.lock:
+            self.watcher.close()
+
+
+def make_query_handler(server):
+    """Return a request handler class answering queries from a DuplicateServer."""
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import parse_qs, urlsplit
+    
+    class QueryHandler(BaseHTTPRequestHandler):
+        server_version = 'DuplicateFinder'
+        
+        def send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if url.path == '/status':
+                self.send_json(200, server.status())
+            elif url.path == '/groups':
+                self.send_json(200, {'groups': server.groups()})
+            elif url.path == '/lookup' and 'name' in query:
+                self.send_json(200, {'query': query, 'matches': server.find_name(query['name'])})
+            elif url.path == '/lookup' and 'hash' in query:
+                try:
+                    size = int(query['size'])
+                except (KeyError, ValueError):
+                    self.send_json(400, {'error': 'lookups by hash need the file size'})
+                    return
+                matches = server.find_content(size, query['hash'], query.get('partial'))
+                self.send_json(200, {'query': query, 'matches': matches})
+            elif url.path == '/lookup':
+                self.send_json(400, {'error': 'pass name, or hash and size'})
+            else:
+                self.send_json(404, {'error': f'unknown path: {url.path}'})
+        
+        def log_message(self, format, *args):
+            pass
+    
+    return QueryHandler
+
+
+def query_server(url, path, **params):
+    """Send a query to a running server and return its JSON answer. Raises OSError if it fails."""
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+    
+    address = url.rstrip('/') + path
+    if params:
+        address += '?' + urllib.parse.urlencode(params)
+    try:
+        with urllib.request.urlopen(address, timeout=QUERY_TIMEOUT) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read().decode('utf-8'))['error']
+        except (ValueError, KeyError):
+            message = e.reason
+        raise OSError(f"{address}: {message}") from None
+    except ValueError as e:
+        raise OSError(f"{address}: {e}") from None
+
+
+def file_query(path, chunk_size=HASH_CHUNK_SIZE):
+    """Query parameters looking up the content of a local file."""
+    size = os.path.getsize(path)
+    partial = hash_partial(path, size)
+    full = partial if size <= PARTIAL_HASH_SIZE * 2 else hash_full(path, chunk_size)
+    return {'size': size, 'hash': full, 'partial': partial}
+
+
+# ===== SNAPSHOTS =====
+SNAPSHOT_FORMAT = 'duplicate_finder.snapshot'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSION = '.dfsnap'
+
+
+def save_snapshot(path, groups, roots, match_mode, extensions=()):
+    """
+    Write the groups of scan_groups(roots) to a compressed snapshot file.
+    
+    The groups are stored column by column, one list per group field and
+    one per member field, in a zlib compressed JSON document. Member paths
+    are kept relative to their root with '/' separators, so snapshots of
+    the same tree checked out in different places compare equal. Returns
+    the number of groups written.
+    """
+    keys = []
+    counts = []
+    member_roots = []
+    member_paths = []
+    member_sizes = []
+    for group in groups:
+        keys.append(group['key'])
+        counts.append(len(group['members']))
+        for member in group['members']:
+            member_roots.append(member['root'])
+            member_paths.append(os.path.relpath(member['path'], roots[member['root']]).replace(os.sep, '/'))
+            member_sizes.append(member['size'])
+    
+    document = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'match': match_mode,
+        'roots': [os.path.abspath(root) for root in roots],
+        'extensions': sorted(extensions),
+        'groups': {'key': keys, 'count': counts},
+        'members': {'root': member_roots, 'path': member_paths, 'size': member_sizes},
+    }
+    data = zlib.compress(json.dumps(document, separators=(',', ':')).encode('utf-8'), 9)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(keys)
+
+
+def load_snapshot(path):
+    """
+    Read a snapshot written by save_snapshot().
+    
+    Returns a dict with the 'match' mode, 'roots', 'extensions', 'created'
+    time and the 'groups' in the form of scan_groups(), member paths being
+    relative to their root. Raises ValueError if the file is not a snapshot.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        document = json.loads(zlib.decompress(data).decode('utf-8'))
+    except (zlib.error, ValueError):
+        raise ValueError(f"not a snapshot file: {path}") from None
+    if not isinstance(document, dict) or document.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"not a snapshot file: {path}")
+    if document.get('version', 0) > SNAPSHOT_VERSION:
+        raise ValueError(f"snapshot was written by a newer version: {path}")
+    
+    members = document['members']
+    groups = []
+    start = 0
+    for key, count in zip(document['groups']['key'], document['groups']['count']):
+        end = start + count
+        group_members = [
+            {'root': root, 'path': member_path, 'size': size}
+            for root, member_path, size in zip(
+                members['root'][start:end], members['path'][start:end], members['size'][start:end]
+            )
+        ]
+        groups.append({'key': key, 'size': sum(m['size'] for m in group_members), 'members': group_members})
+        start = end
+    return {
+        'match': document['match'],
+        'roots': document['roots'],
+        'extensions': document['extensions'],
+        'created': document['created'],
+        'groups': groups,
+    }
+
+
+def _group_identity(match_mode, group):
+    # Near-duplicate keys are similarities, so those pairs are told apart by their files
+    if match_mode == 'near':
+        return tuple(sorted((m['root'], m['path']) for m in group['members']))
+    return group['key']
+
+
+def _member_files(group):
+    return frozenset((m['root'], m['path']) for m in group['members'])
+
+
+def diff_snapshots(old, new):
+    """
+    Yield the duplicate groups that differ between two snapshots.
+    
+    Groups are matched by key. Groups left over on both sides that hold the
+    same files, e.g. after every copy of a file was re-saved, are matched
+    too. Records have 'change' ('new', 'resolved' or 'changed') and the
+    'key', 'size' and 'members' of the group, taken from the old snapshot
+    for resolved groups. Changed groups also have 'previous_key',
+    'previous_size' and the 'added' and 'removed' members. Raises
+    ValueError if the snapshots use different match modes.
+    """
+    if old['match'] != new['match']:
+        raise ValueError(f"snapshots use different match modes: {old['match']} and {new['match']}")
+    mode = new['match']
+    old_groups = {_group_identity(mode, group): group for group in old['groups']}
+    new_groups = {_group_identity(mode, group): group for group in new['groups']}
+    
+    unmatched = {_member_files(group): ident for ident, group in old_groups.items() if ident not in new_groups}
+    previous_of = {}
+    for ident, group in new_groups.items():
+        if ident not in old_groups and _member_files(group) in unmatched:
+            previous_of[ident] = unmatched.pop(_member_files(group))
+    
+    for ident, group in new_groups.items():
+        previous = old_groups.get(previous_of.get(ident, ident))
+        record = {'change': 'new', 'key': group['key'], 'size': group['size'], 'members': group['members']}
+        if previous is None:
+            yield record
+            continue
+        members = {(m['root'], m['path'], m['size']): m for m in group['members']}
+        previous_members = {(m['root'], m['path'], m['size']): m for m in previous['members']}
+        if previous['key'] == group['key'] and members.keys() == previous_members.keys():
+            continue
+        record.update(
+            change='changed',
+            previous_key=previous['key'],
+            previous_size=previous['size'],
+            added=[m for k, m in members.items() if k not in previous_members],
+            removed=[m for k, m in previous_members.items() if k not in members],
+        )
+        yield record
+    
+    matched = set(previous_of.values())
+    for ident, group in old_groups.items():
+        if ident not in new_groups and ident not in matched:
+            yield {'change': 'resolved', 'key': group['key'], 'size': group['size'], 'members': group['members']}
+
+
+# ===== DELETION =====
+# Files passed to one send2trash call
+TRASH_BATCH_SIZE = 200
+# Batches moved to the recycle bin at the same time
+TRASH_WORKERS = 4
+# Folder next to the application holding the journals of bulk operations
+JOURNAL_DIRNAME = 'journals'
+
+
+def timestamped_path(dirname, prefix, ext):
+    """Return a new timestamped file path in a folder next to the application."""
+    folder = os.path.join(get_app_dir(), dirname)
+    os.makedirs(folder, exist_ok=True)
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(folder, f"{prefix}_{stamp}{ext}")
+    counter = 1
+    while os.path.exists(path):
+        counter += 1
+        path = os.path.join(folder, f"{prefix}_{stamp}_{counter}{ext}")
+    return path
+
+
+def default_journal_path(action):
+    """Return a new timestamped journal path for an action like 'trash'."""
+    return timestamped_path(JOURNAL_DIRNAME, action, '.jsonl')
+
+
+class Journal:
+    """
+    Append-only JSON Lines record of a bulk file operation.
+    
+    The first line describes the operation, every following line one file.
+    Records are written a batch at a time so journaling does not slow the
+    operation down.
+    """
+    
+    def __init__(self, path, action, dry_run=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'w', encoding='utf-8')
+        self.write([{
+            'action': action,
+            'dry_run': dry_run,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }])
+    
+    def write(self, records):
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        with self.lock:
+            self.file.write(lines)
+            self.file.flush()
+    
+    def close(self):
+        self.file.close()
+
+
+def read_journal(path):
+    """Return (header, records) of a journal."""
+    with open(path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines:
+        return {}, []
+    return lines[0], lines[1:]
+
+
+def trash_files(paths, dry_run=False, journal_path=None, batch_size=TRASH_BATCH_SIZE,
+                workers=TRASH_WORKERS, progress=None, keep=()):
+    """
+    Move files to the recycle bin in parallel batches.
+    
+    Every file is recorded in a journal with its size and status ('moved',
+    'would_move' in a dry run, 'missing' or 'error'). Paths that resolve to
+    one of the kept files in keep are refused as errors. progress is called
+    with (done, total) after each batch, from a worker thread. Returns a
+    dict with 'moved', 'missing' and 'errors' counts and the 'journal' path.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    paths = list(dict.fromkeys(os.path.abspath(path) for path in paths))
+    kept = {os.path.realpath(path) for path in keep}
+    send2trash = None if dry_run else load_send2trash()
+    journal = Journal(journal_path or default_journal_path('trash'), 'trash', dry_run)
+    summary = {'moved': 0, 'missing': 0, 'errors': 0, 'journal': journal.path}
+    lock = threading.Lock()
+    done = [0]
+    
+    def move(path):
+        try:
+            send2trash(path)
+            return None
+        except Exception as e:
+            return str(e)
+    
+    def run_batch(batch):
+        records = []
+        existing = []
+        for path in batch:
+            if split_archive_path(path) is not None:
+                records.append({'path': path, 'status': 'error', 'error': 'file is inside an archive'})
+                continue
+            if kept and os.path.realpath(path) in kept:
+                records.append({'path': path, 'status': 'error', 'error': 'file is the copy to keep'})
+                continue
+            try:
+                existing.append({'path': path, 'size': os.stat(path).st_size})
+            except OSError:
+                records.append({'path': path, 'status': 'missing'})
+        
+        if dry_run:
+            for record in existing:
+                record['status'] = 'would_move'
+        elif existing:
+            error = move([record['path'] for record in existing])
+            for record in existing:
+                if error is None or not os.path.exists(record['path']):
+                    record['status'] = 'moved'
+                    continue
+                # A single bad file fails the whole batch, so retry the rest one by one
+                record_error = move(record['path'])
+                if record_error is None:
+                    record['status'] = 'moved'
+                else:
+                    record['status'] = 'error'
+                    record['error'] = record_error
+        records.extend(existing)
+        journal.write(records)
+        
+        with lock:
+            for record in records:
+                if record['status'] in ('moved', 'would_move'):
+                    summary['moved'] += 1
+                elif record['status'] == 'missing':
+                    summary['missing'] += 1
+                else:
+                    summary['errors'] += 1
+            done[0] += len(batch)
+            count = done[0]
+        if progress is not None:
+            progress(count, len(paths))
+    
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            list(pool.map(run_batch, batches))
+    finally:
+        journal.close()
+    return summary
+
+
+def _trash_dirs(path):
+    """Freedesktop trash folders that may hold a file deleted from path."""
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    dirs = [(os.path.join(data_home, 'Trash'), None)]
+    top = os.path.dirname(path)
+    while not os.path.ismount(top) and os.path.dirname(top) != top:
+        top = os.path.dirname(top)
+    if hasattr(os, 'getuid'):
+        dirs.append((os.path.join(top, f".Trash-{os.getuid()}"), top))
+        dirs.append((os.path.join(top, '.Trash', str(os.getuid())), top))
+    return dirs
+
+
+def restore_from_journal(journal_path):
+    """
+    Move files recorded as trashed in a journal back to their folders.
+    
+    Only the freedesktop.org trash used on Linux can be read back; on Windows
+    and macOS the journal lists what to restore from the Recycle Bin.
+    Returns (restored, failed) lists of paths.
+    """
+    from urllib.parse import unquote
+    
+    header, records = read_journal(journal_path)
+    wanted = [r['path'] for r in records if r.get('status') == 'moved']
+    if header.get('action') != 'trash' or not wanted or sys.platform in ('win32', 'darwin'):
+        return [], wanted
+    
+    # Map original paths to trashed files, keeping the latest deletion
+    trashed = {}
+    for trash_dir, top in {d for path in wanted for d in _trash_dirs(os.path.abspath(path))}:
+        info_dir = os.path.join(trash_dir, 'info')
+        if not os.path.isdir(info_dir):
+            continue
+        for name in os.listdir(info_dir):
+            if not name.endswith('.trashinfo'):
+                continue
+            original = deleted = None
+            with open(os.path.join(info_dir, name), encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith('Path='):
+                        original = unquote(line[5:].strip())
+                    elif line.startswith('DeletionDate='):
+                        deleted = line[13:].strip()
+            if original is None:
+                continue
+            if top is not None and not os.path.isabs(original):
+                original = os.path.join(top, original)
+            entry = (deleted or '', os.path.join(trash_dir, 'files', name[:-10]), os.path.join(info_dir, name))
+            if original not in trashed or entry > trashed[original]:
+                trashed[original] = entry
+    
+    restored = []
+    failed = []
+    for path in wanted:
+        entry = trashed.get(os.path.abspath(path))
+        if entry is None or os.path.exists(path):
+            failed.append(path)
+            continue
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            os.replace(entry[1], path)
+            os.remove(entry[2])
+            restored.append(path)
+        except OSError:
+            failed.append(path)
+    return restored, failed
+
+
+# ===== LINK DEDUPLICATION =====
+# ioctl cloning a whole file on btrfs/xfs, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+LINK_MODES = ('auto', 'reflink', 'hardlink')
+# Pairs handed to one worker at a time
+LINK_BATCH_SIZE = 50
+# Batches linked at the same time
+LINK_WORKERS = 4
+# Errors meaning the file system cannot clone files
+NO_REFLINK_ERRNOS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.ENOSYS}
+
+
+def reflink(source, dest):
+    """Create dest as a copy-on-write clone of source (btrfs, xfs)."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform", dest)
+    with open(source, 'rb') as src:
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(fd, FICLONE, src.fileno())
+        except OSError:
+            os.close(fd)
+            os.remove(dest)
+            raise
+        os.close(fd)
+
+
+def link_file(path, source, mode='auto'):
+    """
+    Atomically replace path with a reflink or hardlink of source.
+    
+    The link is created next to path under a temporary name, hashed and
+    compared with the hash of path taken just before, then moved over path
+    with os.replace. Returns 'reflink', 'hardlink', 'already_linked',
+    'different' when the contents differ or 'changed' when path was
+    modified meanwhile.
+    """
+    st = os.stat(path)
+    source_st = os.stat(source)
+    if os.path.samestat(st, source_st):
+        return 'already_linked'
+    if st.st_size != source_st.st_size:
+        return 'different'
+    digest = hash_full(path)
+    
+    folder, name = os.path.split(path)
+    tmp = os.path.join(folder, f".{name}.{os.getpid()}.{threading.get_ident()}.link")
+    kind = None
+    if mode != 'hardlink':
+        try:
+            reflink(source, tmp)
+            kind = 'reflink'
+        except OSError as e:
+            if mode == 'reflink' or e.errno not in NO_REFLINK_ERRNOS:
+                raise
+    if kind is None:
+        os.link(source, tmp)
+        kind = 'hardlink'
+    
+    try:
+        if hash_full(tmp) != digest:
+            os.remove(tmp)
+            return 'different'
+        current = os.stat(path)
+        if (current.st_size, current.st_mtime_ns, current.st_ino) != (st.st_size, st.st_mtime_ns, st.st_ino):
+            os.remove(tmp)
+            return 'changed'
+        if kind == 'reflink':
+            # A clone is a new file, keep the metadata of the one it replaces
+            os.chmod(tmp, stat.S_IMODE(st.st_mode))
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return kind
+
+
+def link_files(pairs, mode='auto', dry_run=False, journal_path=None, batch_size=LINK_BATCH_SIZE,
+               workers=LINK_WORKERS, progress=None):
+    """
+    Replace duplicates with links to the copies that are kept.
+    
+    pairs holds (path, source) tuples, path being replaced by a link to
+    source (see link_file). Every pair is recorded in a journal with its
+    size and status ('reflink', 'hardlink', 'would_link' in a dry run,
+    'already_linked', 'different', 'changed', 'missing' or 'error').
+    progress is called with (done, total) after each batch, from a worker
+    thread. Returns a dict with 'linked', 'skipped', 'missing' and 'errors'
+    counts, the 'reclaimed' bytes and the 'journal' path.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    pairs = list(dict((os.path.abspath(path), os.path.abspath(source)) for path, source in pairs).items())
+    journal = Journal(journal_path or default_journal_path('link'), 'link', dry_run)
+    summary = {'linked': 0, 'skipped': 0, 'missing': 0, 'errors': 0, 'reclaimed': 0, 'journal': journal.path}
+    lock = threading.Lock()
+    done = [0]
+    
+    def run_batch(batch):
+        records = []
+        for path, source in batch:
+            record = {'path': path, 'source': source}
+            records.append(record)
+            if split_archive_path(path) is not None or split_archive_path(source) is not None:
+                record.update(status='error', error='file is inside an archive')
+                continue
+            try:
+                st = os.stat(path)
+                source_st = os.stat(source)
+            except OSError:
+                record['status'] = 'missing'
+                continue
+            record['size'] = st.st_size
+            if os.path.samestat(st, source_st):
+                record['status'] = 'already_linked'
+            elif st.st_size != source_st.st_size:
+                record['status'] = 'different'
+            elif dry_run:
+                record['status'] = 'would_link'
+            else:
+                try:
+                    record['status'] = link_file(path, source, mode)
+                except OSError as e:
+                    record.update(status='error', error=str(e))
+        journal.write(records)
+        
+        with lock:
+            for record in records:
+                if record['status'] in ('reflink', 'hardlink', 'would_link'):
+                    summary['linked'] += 1
+                    # Blocks are only freed once no other hardlink uses the replaced file
+                    summary['reclaimed'] += record['size']
+                elif record['status'] == 'missing':
+                    summary['missing'] += 1
+                elif record['status'] == 'error':
+                    summary['errors'] += 1
+                else:
+                    summary['skipped'] += 1
+            done[0] += len(batch)
+            count = done[0]
+        if progress is not None:
+            progress(count, len(pairs))
+    
+    batches = [pairs[i:i + batch_size] for i in range(0, len(pairs), batch_size)]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            list(pool.map(run_batch, batches))
+    finally:
+        journal.close()
+    return summary
+
+
+# ===== RESULTS VIEW =====
+# Interval in ms at which the GUI picks up scan results and progress
+SCAN_POLL_MS = 100
+
+
+class VirtualResultsView:
+    """
+    Drive a Treeview that only holds items for the visible rows.
+    
+    Rows stay in a plain list and a small pool of Treeview items is refilled
+    from it whenever the view scrolls or resizes, so showing or clearing
+    100k+ results costs the same as showing a screenful. row_func turns a
+    row into the column values and is only called for visible rows.
+    """
+    
+    def __init__(self, tree, scrollbar, row_func):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.row_func = row_func
+        self.rows = []
+        self.offset = 0
+        self.items = []
+        self.selected = set()
+        self.row_height = 20
+        self.header_height = 25
+        
+        self.scrollbar.configure(command=self.yview)
+        self.tree.bind("<Configure>", lambda e: self.refresh())
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-self.page_size()))
+        self.tree.bind("<Next>", lambda e: self.scroll(self.page_size()))
+        self.tree.bind("<Home>", lambda e: self.scroll_to(0))
+        self.tree.bind("<End>", lambda e: self.scroll_to(len(self.rows)))
+        self.tree.bind("<Up>", lambda e: self.on_arrow(-1))
+        self.tree.bind("<Down>", lambda e: self.on_arrow(1))
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+    
+    def set_rows(self, rows):
+        """Replace all rows and scroll back to the top."""
+        self.rows = rows
+        self.offset = 0
+        self.selected = set()
+        self.refresh()
+    
+    def update_rows(self, remove, added):
+        """
+        Drop the rows for which remove(row) is true, then append added.
+        
+        The row list is changed in place. The view stays on the rows it
+        showed and the selection stays on the same rows.
+        """
+        if remove is not None:
+            kept = []
+            selected = set()
+            offset = self.offset
+            for i, row in enumerate(self.rows):
+                if remove(row):
+                    if i < self.offset:
+                        offset -= 1
+                    continue
+                if i in self.selected:
+                    selected.add(len(kept))
+                kept.append(row)
+            self.rows[:] = kept
+            self.selected = selected
+            self.offset = offset
+        self.rows.extend(added)
+        self.refresh()
+    
+    def page_size(self):
+        """Number of rows that fit completely in the view."""
+        if self.items:
+            bbox = self.tree.bbox(self.items[0])
+            if bbox:
+                self.header_height = bbox[1]
+                self.row_height = bbox[3] or self.row_height
+        height = self.tree.winfo_height() - self.header_height
+        return max(1, height // self.row_height)
+    
+    def refresh(self):
+        """Fill the item pool with the rows at the current offset."""
+        page = self.page_size()
+        self.offset = max(0, min(self.offset, len(self.rows) - page))
+        # One extra item shows the partially visible last row
+        count = max(0, min(page + 1, len(self.rows) - self.offset))
+        
+        while len(self.items) < count:
+            self.items.append(self.tree.insert("", tk.END))
+        while len(self.items) > count:
+            self.tree.delete(self.items.pop())
+        
+        selection = []
+        for i, item in enumerate(self.items):
+            row = self.offset + i
+            self.tree.item(item, values=self.row_func(self.rows[row]))
+            if row in self.selected:
+                selection.append(item)
+        self.tree.selection_set(selection)
+        
+        if self.rows:
+            first = self.offset / len(self.rows)
+            last = min(1.0, (self.offset + page) / len(self.rows))
+            self.scrollbar.set(first, last)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def scroll(self, delta):
+        self.scroll_to(self.offset + delta)
+        return "break"
+    
+    def scroll_to(self, offset):
+        self.offset = offset
+        self.refresh()
+        return "break"
+    
+    def yview(self, *args):
+        """Scrollbar command."""
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * len(self.rows)))
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if args[2] == 'pages':
+                amount *= self.page_size()
+            self.scroll(amount)
+    
+    def on_mousewheel(self, event):
+        # Windows reports multiples of 120, macOS reports small steps
+        steps = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self.scroll(-3 * steps)
+    
+    def on_arrow(self, direction):
+        """Scroll when the keyboard focus moves past the first or last visible row."""
+        focus = self.tree.focus()
+        if focus not in self.items:
+            return None
+        position = self.items.index(focus)
+        last = min(len(self.items), self.page_size()) - 1
+        if (direction < 0 and position == 0) or (direction > 0 and position >= last):
+            self.scroll(direction)
+            return "break"
+        return None
+    
+    def on_select(self, event):
+        """Remember selected rows so they survive scrolling."""
+        visible = range(self.offset, self.offset + len(self.items))
+        self.selected.difference_update(visible)
+        for item in self.tree.selection():
+            if item in self.items:
+                self.selected.add(self.offset + self.items.index(item))
+    
+    def selected_rows(self):
+        return [self.rows[i] for i in sorted(self.selected) if i < len(self.rows)]
+
+
 class DuplicateFinderApp:
     def __init__(self, root):
         self.root = root
@@ -132,10 +3501,25 @@ class DuplicateFinderApp:
         self.ext_ytyp = tk.BooleanVar(value=True)
         self.ext_ybn = tk.BooleanVar(value=True)
         self.delete_from = tk.StringVar(value="path1")
+        self.dry_run = tk.BooleanVar(value=False)
+        self.match_mode = tk.StringVar(value="name")
+        self.use_index = tk.BooleanVar(value=True)
+        self.profile_scan = tk.BooleanVar(value=False)
+        self.watch_changes = tk.BooleanVar(value=False)
+        self.scan_archives = tk.BooleanVar(value=False)
+        self.rules_name = tk.StringVar()
         
+        self.rules = None
         self.duplicates = []
-        self.files_path1 = {}
-        self.files_path2 = {}
+        self.total_size = 0
+        self.scanner = None
+        # Duplicate groups of the last finished scan and its folders, for snapshots
+        self.groups = None
+        self.scan_roots = []
+        self.scan_queue = queue.Queue()
+        self.watch_updates = 0
+        self.delete_queue = queue.Queue()
+        self.file_action = 'trash'
         
         self.create_widgets()
     
@@ -172,9 +3556,26 @@ class DuplicateFinderApp:
         self.delete_label.config(text=self.t('delete_from'))
         self.radio_path1.config(text=self.t('folder_1').replace(':', ''))
         self.radio_path2.config(text=self.t('folder_2').replace(':', ''))
+        self.radio_rules.config(text=self.t('delete_by_rules'))
+        self.rules_btn.config(text=self.t('rules_btn'))
+        if self.rules is None:
+            self.rules_name.set(self.t('rules_none'))
+        self.chk_dry_run.config(text=self.t('dry_run'))
+        self.match_label.config(text=self.t('match_by'))
+        self.radio_match_name.config(text=self.t('match_name'))
+        self.radio_match_content.config(text=self.t('match_content'))
+        self.radio_match_structure.config(text=self.t('match_structure'))
+        self.radio_match_near.config(text=self.t('match_near'))
+        self.chk_index.config(text=self.t('use_index'))
+        self.chk_profile.config(text=self.t('profile'))
+        self.chk_watch.config(text=self.t('watch'))
+        self.chk_archives.config(text=self.t('archives'))
         self.scan_btn.config(text=self.t('scan_btn'))
         self.delete_btn.config(text=self.t('delete_btn'))
+        self.link_btn.config(text=self.t('link_btn'))
+        self.snapshot_btn.config(text=self.t('snapshot_btn'))
         self.clear_btn.config(text=self.t('clear_btn'))
+        self.cancel_btn.config(text=self.t('cancel_btn'))
         self.results_frame.config(text=self.t('results'))
         self.lang_btn.config(text=self.t('lang_btn'))
         
@@ -259,6 +3660,14 @@ class DuplicateFinderApp:
         self.chk_ytyp.pack(side=tk.LEFT, padx=10)
         self.chk_ybn = ttk.Checkbutton(ext_frame, text=self.t('ext_ybn'), variable=self.ext_ybn)
         self.chk_ybn.pack(side=tk.LEFT, padx=10)
+        self.chk_archives = ttk.Checkbutton(ext_frame, text=self.t('archives'), variable=self.scan_archives)
+        self.chk_archives.pack(side=tk.LEFT, padx=10)
+        self.rules_clear_btn = ttk.Button(ext_frame, text='✖', width=3, command=self.clear_rules_file, state=tk.DISABLED)
+        self.rules_clear_btn.pack(side=tk.RIGHT)
+        self.rules_btn = ttk.Button(ext_frame, text=self.t('rules_btn'), command=self.load_rules_file)
+        self.rules_btn.pack(side=tk.RIGHT, padx=5)
+        self.rules_name.set(self.t('rules_none'))
+        ttk.Label(ext_frame, textvariable=self.rules_name, foreground='gray').pack(side=tk.RIGHT, padx=5)
         
         # Delete option
         delete_frame = ttk.Frame(self.config_frame)
@@ -270,6 +3679,31 @@ class DuplicateFinderApp:
         self.radio_path1.pack(side=tk.LEFT, padx=10)
         self.radio_path2 = ttk.Radiobutton(delete_frame, text=self.t('folder_2').replace(':', ''), variable=self.delete_from, value="path2")
         self.radio_path2.pack(side=tk.LEFT, padx=10)
+        self.radio_rules = ttk.Radiobutton(delete_frame, text=self.t('delete_by_rules'), variable=self.delete_from, value="rules", state=tk.DISABLED)
+        self.radio_rules.pack(side=tk.LEFT, padx=10)
+        self.chk_dry_run = ttk.Checkbutton(delete_frame, text=self.t('dry_run'), variable=self.dry_run)
+        self.chk_dry_run.pack(side=tk.LEFT, padx=10)
+        
+        # Match mode
+        match_frame = ttk.Frame(self.config_frame)
+        match_frame.pack(fill=tk.X, pady=5)
+        
+        self.match_label = ttk.Label(match_frame, text=self.t('match_by'))
+        self.match_label.pack(side=tk.LEFT, padx=(0, 10))
+        self.radio_match_name = ttk.Radiobutton(match_frame, text=self.t('match_name'), variable=self.match_mode, value="name")
+        self.radio_match_name.pack(side=tk.LEFT, padx=10)
+        self.radio_match_content = ttk.Radiobutton(match_frame, text=self.t('match_content'), variable=self.match_mode, value="content")
+        self.radio_match_content.pack(side=tk.LEFT, padx=10)
+        self.radio_match_structure = ttk.Radiobutton(match_frame, text=self.t('match_structure'), variable=self.match_mode, value="structure")
+        self.radio_match_structure.pack(side=tk.LEFT, padx=10)
+        self.radio_match_near = ttk.Radiobutton(match_frame, text=self.t('match_near'), variable=self.match_mode, value="near")
+        self.radio_match_near.pack(side=tk.LEFT, padx=10)
+        self.chk_index = ttk.Checkbutton(match_frame, text=self.t('use_index'), variable=self.use_index)
+        self.chk_index.pack(side=tk.LEFT, padx=10)
+        self.chk_profile = ttk.Checkbutton(match_frame, text=self.t('profile'), variable=self.profile_scan)
+        self.chk_profile.pack(side=tk.LEFT, padx=10)
+        self.chk_watch = ttk.Checkbutton(match_frame, text=self.t('watch'), variable=self.watch_changes)
+        self.chk_watch.pack(side=tk.LEFT, padx=10)
         
         # ===== ACTION BUTTONS =====
         action_frame = ttk.Frame(main_frame)
@@ -291,6 +3725,22 @@ class DuplicateFinderApp:
         )
         self.delete_btn.pack(side=tk.LEFT, padx=5)
         
+        self.link_btn = ttk.Button(
+            action_frame, 
+            text=self.t('link_btn'), 
+            command=self.link_duplicates,
+            state=tk.DISABLED
+        )
+        self.link_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.snapshot_btn = ttk.Button(
+            action_frame, 
+            text=self.t('snapshot_btn'), 
+            command=self.save_snapshot_file,
+            state=tk.DISABLED
+        )
+        self.snapshot_btn.pack(side=tk.LEFT, padx=5)
+        
         self.clear_btn = ttk.Button(
             action_frame, 
             text=self.t('clear_btn'), 
@@ -298,6 +3748,14 @@ class DuplicateFinderApp:
         )
         self.clear_btn.pack(side=tk.LEFT, padx=5)
         
+        self.cancel_btn = ttk.Button(
+            action_frame, 
+            text=self.t('cancel_btn'), 
+            command=self.cancel_scan,
+            state=tk.DISABLED
+        )
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        
         # Status
         self.status_var = tk.StringVar(value=self.t('status_ready'))
         status_label = ttk.Label(action_frame, textvariable=self.status_var, foreground="gray")
@@ -328,9 +3786,12 @@ class DuplicateFinderApp:
         self.tree.column("path2", width=250)
         self.tree.column("size", width=80)
         
-        scrollbar_y = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        scrollbar_y = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL)
         scrollbar_x = ttk.Scrollbar(tree_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
-        self.tree.configure(yscrollcommand=scrollbar_y.set, xscrollcommand=scrollbar_x.set)
+        self.tree.configure(xscrollcommand=scrollbar_x.set)
+        
+        # Only the visible rows get Treeview items
+        self.results_view = VirtualResultsView(self.tree, scrollbar_y, self.format_row)
         
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar_y.pack(side=tk.RIGHT, fill=tk.Y)
@@ -351,8 +3812,41 @@ class DuplicateFinderApp:
             else:
                 self.path2.set(folder)
     
+    def load_rules_file(self):
+        """Scan with the extension sets, filters and keep policies of a rules file."""
+        path = filedialog.askopenfilename(
+            title=self.t('rules_title'),
+            filetypes=[(self.t('rules_files'), '*.json')]
+        )
+        if not path:
+            return
+        try:
+            rules = load_rules(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", self.t('err_rules', error=str(e)))
+            return
+        self.set_rules(rules, os.path.basename(path))
+    
+    def clear_rules_file(self):
+        self.set_rules(None, self.t('rules_none'))
+    
+    def set_rules(self, rules, name):
+        self.rules = rules
+        self.rules_name.set(name)
+        self.rules_clear_btn.config(state=tk.DISABLED if rules is None else tk.NORMAL)
+        # Extension sets of the rules replace the checkboxes
+        state = tk.DISABLED if rules is not None and rules.extensions else tk.NORMAL
+        for check in (self.chk_ycd, self.chk_ydr, self.chk_ytyp, self.chk_ybn):
+            check.config(state=state)
+        has_keep = rules is not None and bool(rules.keep)
+        self.radio_rules.config(state=tk.NORMAL if has_keep else tk.DISABLED)
+        if not has_keep and self.delete_from.get() == "rules":
+            self.delete_from.set("path1")
+    
     def get_extensions(self):
         """Return set of selected extensions."""
+        if self.rules is not None and self.rules.extensions:
+            return set(self.rules.extensions)
         extensions = set()
         if self.ext_ycd.get():
             extensions.add('.ycd')
@@ -364,22 +3858,6 @@ class DuplicateFinderApp:
             extensions.add('.ybn')
         return extensions
     
-    def get_files_from_path(self, base_path, extensions):
-        """Collect files from a directory."""
-        files = defaultdict(list)
-        
-        if not os.path.exists(base_path):
-            return files
-        
-        for root, dirs, filenames in os.walk(base_path):
-            for filename in filenames:
-                ext = os.path.splitext(filename)[1].lower()
-                if ext in extensions:
-                    full_path = os.path.join(root, filename)
-                    files[filename.lower()].append(full_path)
-        
-        return files
-    
     def format_size(self, size_bytes):
         """Format size in readable format."""
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -405,6 +3883,12 @@ class DuplicateFinderApp:
             messagebox.showerror("Error", self.t('err_folder2_not_found', path=path2))
             return
         
+        try:
+            check_roots([path1, path2])
+        except ValueError as e:
+            messagebox.showerror("Error", self.t('err_folders_overlap', error=str(e)))
+            return
+        
         extensions = self.get_extensions()
         if not extensions:
             messagebox.showwarning("Warning", self.t('warn_select_extension'))
@@ -413,105 +3897,345 @@ class DuplicateFinderApp:
         # Disable buttons during scan
         self.scan_btn.config(state=tk.DISABLED)
         self.delete_btn.config(state=tk.DISABLED)
+        self.link_btn.config(state=tk.DISABLED)
+        self.snapshot_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
         self.status_var.set(self.t('status_scanning'))
         
-        # Run in separate thread
-        thread = threading.Thread(target=self.scan_folders, args=(path1, path2, extensions))
+        self.duplicates = []
+        self.total_size = 0
+        self.groups = None
+        self.scan_roots = [path1, path2]
+        self.results_view.set_rows(self.duplicates)
+        self.summary_var.set("")
+        profiler = ScanProfiler(use_cprofile=True) if self.profile_scan.get() else None
+        self.scanner = DuplicateScanner(
+            extensions, self.match_mode.get(), self.use_index.get(), profiler=profiler,
+            archives=self.scan_archives.get(), rules=self.rules
+        )
+        self.scan_queue = queue.Queue()
+        self.watch_updates = 0
+        
+        # Run in separate thread, results are picked up by poll_scan
+        watch = self.watch_changes.get() and self.scanner.match_mode != "near"
+        thread = threading.Thread(
+            target=self.watch_folders if watch else self.scan_folders,
+            args=(self.scanner, self.scan_queue, path1, path2),
+            daemon=True
+        )
         thread.start()
+        self.root.after(SCAN_POLL_MS, self.poll_scan)
+    
+    def post_batches(self, results, records):
+        """Post records to the results queue in batches, at most one per poll."""
+        batch = []
+        last_post = time.monotonic()
+        for dup in records:
+            batch.append(dup)
+            if time.monotonic() - last_post >= SCAN_POLL_MS / 1000:
+                results.put(('batch', batch))
+                batch = []
+                last_post = time.monotonic()
+        results.put(('batch', batch))
+    
+    def scan_folders(self, scanner, results, path1, path2):
+        """Scan folders and post batches of duplicates to the results queue."""
+        groups = []
+        
+        def pairs():
+            for group in scanner.scan_groups([path1, path2]):
+                groups.append(group)
+                yield from scanner.group_pairs(group)
+        
+        try:
+            self.post_batches(results, pairs())
+            results.put(('done', groups))
+        except Exception as e:
+            results.put(('error', e))
     
-    def scan_folders(self, path1, path2, extensions):
-        """Scan folders and find duplicates."""
+    def watch_folders(self, scanner, results, path1, path2):
+        """Scan folders, then post the duplicates removed and added whenever files change."""
+        watcher = DuplicateWatcher(scanner, [path1, path2])
+        
+        def post_changes(events):
+            removed = []
+            added = []
+            for event in events:
+                for name, pair in pair_events(scanner, event):
+                    (removed if name == 'removed' else added).append(pair)
+            results.put(('update', (removed, added)))
+        
         try:
-            # Collect files
-            self.files_path1 = self.get_files_from_path(path1, extensions)
-            self.files_path2 = self.get_files_from_path(path2, extensions)
-            
-            # Find duplicates
-            common_files = set(self.files_path1.keys()) & set(self.files_path2.keys())
-            
-            self.duplicates = []
-            total_size = 0
-            
-            for filename in common_files:
-                paths1 = self.files_path1[filename]
-                paths2 = self.files_path2[filename]
-                
-                for p1 in paths1:
-                    size = os.path.getsize(p1)
-                    total_size += size
-                    self.duplicates.append({
-                        'filename': filename,
-                        'path1': p1,
-                        'path2': paths2[0] if paths2 else "",
-                        'size': size
-                    })
-            
-            # Update UI in main thread
-            self.root.after(0, lambda: self.update_results(total_size))
-            
+            source = open_watch_source(
+                watcher.roots, watcher.source_extensions(), workers=scanner.scan_workers, rules=scanner.rules
+            )
+            try:
+                self.post_batches(results, (
+                    dup for event in watcher.start() for dup in scanner.group_pairs(event['group'])
+                ))
+                watcher.watch(source, post_changes)
+            finally:
+                source.close()
+            results.put(('done', list(watcher.current_groups())))
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Error", self.t('err_scan', error=str(e))))
-            self.root.after(0, lambda: self.scan_btn.config(state=tk.NORMAL))
+            results.put(('error', e))
+        finally:
+            watcher.close()
+    
+    def poll_scan(self):
+        """Show new results and progress of the running scan."""
+        start = time.perf_counter()
+        finished = False
+        added = False
+        while True:
+            try:
+                kind, payload = self.scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'batch':
+                self.duplicates.extend(payload)
+                self.total_size += sum(dup['size'] for dup in payload)
+                added = added or bool(payload)
+            elif kind == 'update':
+                removed, new = payload
+                keys = {(dup['path1'], dup['path2'], dup['size']) for dup in removed}
+                # Only the changed rows are touched, so scrolling and selection survive
+                self.results_view.update_rows(
+                    (lambda dup: (dup['path1'], dup['path2'], dup['size']) in keys) if keys else None, new
+                )
+                self.total_size += sum(dup['size'] for dup in new) - sum(dup['size'] for dup in removed)
+                self.watch_updates += 1
+                added = True
+            elif kind == 'error':
+                messagebox.showerror("Error", self.t('err_scan', error=str(payload)))
+                finished = True
+            else:
+                self.groups = payload
+                finished = True
+        
+        if added:
+            self.results_view.refresh()
+            self.summary_var.set(self.t('summary_found', count=len(self.duplicates), size=self.format_size(self.total_size)))
+        
+        if self.scanner.profiler is not None:
+            self.scanner.profiler.add('ui', time.perf_counter() - start)
+        
+        if finished:
+            self.update_results(self.total_size)
+        else:
+            self.status_var.set(self.progress_text(self.scanner.progress.snapshot()))
+            self.root.after(SCAN_POLL_MS, self.poll_scan)
+    
+    def progress_text(self, snapshot):
+        """Status line for a ScanProgress snapshot."""
+        if snapshot['stage'] == 'watch':
+            return self.t('status_watching', count=self.watch_updates)
+        if snapshot['stage'] != 'hash' or not snapshot['bytes_to_hash']:
+            return self.t('status_walking', files=snapshot['files_walked'])
+        eta = snapshot['eta']
+        return self.t(
+            'status_hashing',
+            hashed=self.format_size(snapshot['bytes_hashed']),
+            total=self.format_size(snapshot['bytes_to_hash']),
+            eta=f"{int(eta) // 60}:{int(eta) % 60:02d}" if eta is not None else "--:--"
+        )
+    
+    def cancel_scan(self):
+        """Stop the running scan, keeping the results found so far."""
+        if self.scanner is not None:
+            self.scanner.cancel()
+        self.cancel_btn.config(state=tk.DISABLED)
+    
+    def format_row(self, dup):
+        """Column values of a duplicate in the results view."""
+        filename = dup['filename']
+        if dup.similarity is not None:
+            filename = f"{filename} (~{dup.similarity:.0%})"
+        return (
+            filename,
+            os.path.dirname(dup['path1']),
+            os.path.dirname(dup['path2']),
+            self.format_size(dup['size'])
+        )
     
     def update_results(self, total_size):
         """Update UI with results."""
-        # Clear treeview
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Fill with duplicates
-        for dup in self.duplicates:
-            self.tree.insert("", tk.END, values=(
-                dup['filename'],
-                os.path.dirname(dup['path1']),
-                os.path.dirname(dup['path2']),
-                self.format_size(dup['size'])
-            ))
+        start = time.perf_counter()
+        # Rows are formatted lazily as they scroll into view
+        self.results_view.refresh()
         
         # Update summary
         count = len(self.duplicates)
         if count > 0:
             self.summary_var.set(self.t('summary_found', count=count, size=self.format_size(total_size)))
             self.delete_btn.config(state=tk.NORMAL)
+            self.link_btn.config(state=tk.NORMAL)
         else:
             self.summary_var.set(self.t('summary_none'))
             self.delete_btn.config(state=tk.DISABLED)
+            self.link_btn.config(state=tk.DISABLED)
         
         self.scan_btn.config(state=tk.NORMAL)
-        self.status_var.set(self.t('status_complete'))
+        self.cancel_btn.config(state=tk.DISABLED)
+        # Snapshots of cancelled scans would miss groups; a stopped watch is complete
+        complete = self.groups is not None and self.scanner is not None and (
+            self.scanner.progress.stage == 'watch' or not self.scanner.progress.is_cancelled()
+        )
+        self.snapshot_btn.config(state=tk.NORMAL if complete else tk.DISABLED)
+        if self.scanner is not None and self.scanner.progress.stage == 'watch':
+            self.status_var.set(self.t('status_watch_stopped'))
+        elif self.scanner is not None and self.scanner.progress.is_cancelled():
+            self.status_var.set(self.t('status_cancelled'))
+        elif self.scanner is not None and self.scanner.profiler is not None:
+            profiler = self.scanner.profiler
+            profiler.add('ui', time.perf_counter() - start)
+            path = profiler.save(timestamped_path(ScanProfiler.DIRNAME, 'scan', '.json'))
+            self.status_var.set(self.t('status_profile_saved', path=path))
+        elif self.scanner is not None and self.scanner.progress.archives_skipped:
+            self.status_var.set(self.t('status_archives_skipped', count=self.scanner.progress.archives_skipped))
+        else:
+            self.status_var.set(self.t('status_complete'))
     
     def delete_duplicates(self):
         """Move duplicates to recycle bin."""
+        self.start_file_action('trash')
+    
+    def link_duplicates(self):
+        """Replace duplicates with links to their copies in the other folder."""
+        self.start_file_action('link')
+    
+    def start_file_action(self, action):
+        """Trash or link the duplicates of the selected folder in a worker thread, only of the selected rows if any."""
         if not self.duplicates:
             messagebox.showinfo("Info", self.t('info_no_duplicates'))
             return
+        rows = self.results_view.selected_rows() or self.duplicates
         
         delete_from = self.delete_from.get()
-        folder_name = self.t('folder_1').replace(':', '') if delete_from == "path1" else self.t('folder_2').replace(':', '')
-        
-        confirm = messagebox.askyesno(
-            self.t('confirm_delete_title'),
-            self.t('confirm_delete_msg', count=len(self.duplicates), folder=folder_name)
-        )
+        if delete_from == "rules":
+            folder_name = self.t('rules_folders')
+        elif delete_from == "path1":
+            folder_name = self.t('folder_1').replace(':', '')
+        else:
+            folder_name = self.t('folder_2').replace(':', '')
         
-        if not confirm:
+        if delete_from == "rules":
+            # Every member the keep rules did not pick, in any folder
+            items = []
+            keep = []
+            chosen = None
+            if rows is not self.duplicates:
+                chosen = {dup[field] for dup in rows for field in ('path1', 'path2')}
+            for group in self.groups or ():
+                if chosen is not None and not any(m['path'] in chosen for m in group['members']):
+                    continue
+                kept = self.rules.mark_keep(group, self.scan_roots)
+                if kept is None:
+                    continue
+                keep.append(kept['path'])
+                for member in group['members']:
+                    if member is not kept:
+                        items.append(member['path'] if action == 'trash' else (member['path'], kept['path']))
+            if not items:
+                messagebox.showinfo("Info", self.t('info_no_duplicates'))
+                return
+        else:
+            other = "path2" if delete_from == "path1" else "path1"
+            keep = [dup[other] for dup in self.duplicates]
+            # A file paired with several copies in the other folder is listed once
+            if action == 'trash':
+                items = list(dict.fromkeys(dup[delete_from] for dup in rows))
+            else:
+                links = {}
+                for dup in rows:
+                    links.setdefault(dup[delete_from], dup[other])
+                items = list(links.items())
+        dry_run = self.dry_run.get()
+        prefix = 'delete' if action == 'trash' else 'link'
+        if action == 'trash' and not dry_run and not has_send2trash():
+            messagebox.showerror("Error", self.t('err_send2trash'))
             return
         
+        if not dry_run:
+            confirm = messagebox.askyesno(
+                self.t(f'confirm_{prefix}_title'),
+                self.t(f'confirm_{prefix}_msg', count=len(items), folder=folder_name)
+            )
+            
+            if not confirm:
+                return
+        
+        self.scan_btn.config(state=tk.DISABLED)
         self.delete_btn.config(state=tk.DISABLED)
-        self.status_var.set(self.t('status_deleting'))
+        self.link_btn.config(state=tk.DISABLED)
+        self.status_var.set(self.t('status_deleting' if action == 'trash' else 'status_linking'))
         
-        success = 0
-        errors = 0
+        # Run in separate thread, progress is picked up by poll_delete
+        self.file_action = action
+        self.delete_queue = queue.Queue()
+        thread = threading.Thread(
+            target=self.delete_files,
+            args=(action, items, keep, dry_run, self.delete_queue),
+            daemon=True
+        )
+        thread.start()
+        self.root.after(SCAN_POLL_MS, self.poll_delete)
+    
+    def delete_files(self, action, items, keep, dry_run, results):
+        """Trash or link files and post progress to the results queue. Trashing never touches the files in keep."""
+        def progress(done, total):
+            results.put(('progress', (done, total)))
         
-        for dup in self.duplicates:
+        try:
+            if action == 'trash':
+                summary = trash_files(items, dry_run=dry_run, progress=progress, keep=keep)
+            else:
+                summary = link_files(items, dry_run=dry_run, progress=progress)
+            summary['dry_run'] = dry_run
+            results.put(('done', summary))
+        except Exception as e:
+            results.put(('error', e))
+    
+    def poll_delete(self):
+        """Show progress of the running deletion or linking."""
+        linking = self.file_action == 'link'
+        while True:
             try:
-                path_to_delete = dup['path1'] if delete_from == "path1" else dup['path2']
-                if os.path.exists(path_to_delete):
-                    send2trash(path_to_delete)
-                    success += 1
-            except Exception as e:
-                errors += 1
-                print(f"Error deleting {dup['filename']}: {e}")
+                kind, payload = self.delete_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                done, total = payload
+                key = 'status_linking_progress' if linking else 'status_deleting_progress'
+                self.status_var.set(self.t(key, done=done, total=total))
+            elif kind == 'error':
+                self.scan_btn.config(state=tk.NORMAL)
+                self.delete_btn.config(state=tk.NORMAL)
+                self.link_btn.config(state=tk.NORMAL)
+                messagebox.showerror("Error", self.t('err_link' if linking else 'err_delete', error=str(payload)))
+                return
+            elif linking:
+                self.finish_link(payload)
+                return
+            else:
+                self.finish_delete(payload)
+                return
+        self.root.after(SCAN_POLL_MS, self.poll_delete)
+    
+    def finish_delete(self, summary):
+        """Show the outcome of a deletion."""
+        self.scan_btn.config(state=tk.NORMAL)
+        journal = self.t('journal_msg', path=summary['journal'])
+        
+        if summary['dry_run']:
+            self.delete_btn.config(state=tk.NORMAL)
+            self.link_btn.config(state=tk.NORMAL)
+            messagebox.showinfo(
+                self.t('complete_title'),
+                self.t('dry_run_msg', count=summary['moved']) + '\n\n' + journal
+            )
+            self.status_var.set(self.t('status_dry_run', count=summary['moved']))
+            return
         
         # Clear results
         self.clear_results()
@@ -519,23 +4243,698 @@ class DuplicateFinderApp:
         # Show result
         messagebox.showinfo(
             self.t('complete_title'),
-            self.t('complete_msg', success=success, errors=errors)
+            self.t('complete_msg', success=summary['moved'], errors=summary['errors']) + '\n' + journal
+        )
+        
+        self.status_var.set(self.t('status_removed', count=summary['moved']))
+    
+    def finish_link(self, summary):
+        """Show the outcome of replacing duplicates with links."""
+        self.scan_btn.config(state=tk.NORMAL)
+        journal = self.t('journal_msg', path=summary['journal'])
+        
+        if summary['dry_run']:
+            self.delete_btn.config(state=tk.NORMAL)
+            self.link_btn.config(state=tk.NORMAL)
+            messagebox.showinfo(
+                self.t('complete_title'),
+                self.t('dry_run_link_msg', count=summary['linked']) + '\n\n' + journal
+            )
+            self.status_var.set(self.t('status_dry_run_link', count=summary['linked']))
+            return
+        
+        self.clear_results()
+        
+        size = self.format_size(summary['reclaimed'])
+        messagebox.showinfo(
+            self.t('complete_title'),
+            self.t('link_complete_msg', success=summary['linked'], skipped=summary['skipped'],
+                   errors=summary['errors'], size=size) + '\n' + journal
         )
         
-        self.status_var.set(self.t('status_removed', count=success))
+        self.status_var.set(self.t('status_linked', count=summary['linked'], size=size))
+    
+    def save_snapshot_file(self):
+        """Save the duplicate groups of the last scan to a snapshot file."""
+        path = filedialog.asksaveasfilename(
+            title=self.t('snapshot_title'),
+            defaultextension=SNAPSHOT_EXTENSION,
+            filetypes=[(self.t('snapshot_files'), '*' + SNAPSHOT_EXTENSION)],
+            initialfile=time.strftime('scan_%Y%m%d_%H%M%S') + SNAPSHOT_EXTENSION
+        )
+        if not path:
+            return
+        try:
+            count = save_snapshot(path, self.groups, self.scan_roots, self.scanner.match_mode, self.scanner.extensions)
+        except OSError as e:
+            messagebox.showerror("Error", self.t('err_snapshot', error=str(e)))
+            return
+        self.status_var.set(self.t('status_snapshot_saved', count=count, path=path))
     
     def clear_results(self):
         """Clear results."""
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
+        self.groups = None
+        self.snapshot_btn.config(state=tk.DISABLED)
         self.duplicates = []
+        self.results_view.set_rows(self.duplicates)
         self.summary_var.set("")
         self.delete_btn.config(state=tk.DISABLED)
+        self.link_btn.config(state=tk.DISABLED)
         self.status_var.set(self.t('status_ready'))
 
 
-def main():
+# ===== COMMAND LINE =====
+CSV_FIELDS = ['filename', 'path1', 'path2', 'size']
+CSV_GROUP_FIELDS = ['group', 'key', 'root', 'path', 'size']
+# Extra column of group rows when keep rules pick the file to keep
+CSV_KEEP_FIELD = 'keep'
+
+
+def parse_extensions(value):
+    """Parse a comma separated extension list like '.ydr,ycd'."""
+    extensions = set()
+    for ext in value.split(','):
+        ext = ext.strip().lower()
+        if ext:
+            extensions.add(ext if ext.startswith('.') else '.' + ext)
+    if not extensions:
+        raise argparse.ArgumentTypeError("at least one extension is required")
+    return extensions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='duplicate_finder.py',
+        description='Find duplicate FiveM/RedM asset files between folders. Opens the GUI when run without a command.'
+    )
+    commands = parser.add_subparsers(dest='command')
+    
+    commands.add_parser('gui', help='open the graphical interface (default)')
+    
+    scan = commands.add_parser('scan', help='scan folders and print duplicates to stdout')
+    scan.add_argument('paths', nargs='+', metavar='DIR',
+                      help='folders to compare; two folders print pairs, more print groups')
+    scan.add_argument('--groups', action='store_true',
+                      help='print duplicate groups listing every member, even for two folders')
+    scan.add_argument('--ext', type=parse_extensions,
+                      help=f"comma separated extensions (default: the rules file's, "
+                           f"else {','.join(DEFAULT_EXTENSIONS)})")
+    scan.add_argument('--match', choices=['name', 'content', 'structure', 'near'], default='name',
+                      help='match files by filename, by content hash, by decompressed RSC7 '
+                           'resource content, or find similar .ytyp/.ymap files (default: name)')
+    scan.add_argument('--similarity', type=float, default=NEAR_THRESHOLD,
+                      help='with --match near, lowest estimated similarity reported (default: %(default)s)')
+    scan.add_argument('--format', choices=['json', 'csv'], default='json',
+                      help='json writes one JSON object per line (JSON Lines)')
+    scan.add_argument('--archives', action='store_true',
+                      help='also compare files inside .rpf archives, without extracting them '
+                           '(unencrypted RPF7 only; encrypted archives are skipped)')
+    scan.add_argument('--snapshot', metavar='PATH',
+                      help=f'also save the duplicate groups to a compressed snapshot file '
+                           f'(e.g. release{SNAPSHOT_EXTENSION}) that diff can compare with a later scan')
+    scan.add_argument('--rules', metavar='FILE',
+                      help='JSON rules file with extension groups, include/exclude globs and keep policies; '
+                           'with keep rules, groups are printed with a keep flag on every member')
+    scan.add_argument('--no-index', action='store_true',
+                      help='do not read or update the persistent hash index')
+    scan.add_argument('--index', metavar='PATH', help='hash index file (default: next to the application)')
+    scan.add_argument('--workers', type=int, default=SCAN_WORKERS, help='directory walking threads')
+    scan.add_argument('--hash-workers', type=int, default=HASH_WORKERS, help='hashing threads')
+    scan.add_argument('--chunk-size', type=int, default=HASH_CHUNK_SIZE, help='read size in bytes for full hashes')
+    scan.add_argument('--progress', action='store_true', help='print progress to stderr every second')
+    scan.add_argument('--profile', action='store_true',
+                      help='print per-stage time and I/O counters to stderr after the scan')
+    scan.add_argument('--profile-out', metavar='PATH', help='also dump cProfile data to a pstats file')
+    scan.add_argument('--watch', action='store_true',
+                      help="keep running and print 'added', 'changed' and 'removed' events as files change "
+                           "(uses inotify on Linux, polling elsewhere; Ctrl+C stops)")
+    scan.add_argument('--poll', type=float, metavar='SECONDS',
+                      help=f'with --watch, poll for changes every SECONDS instead of using inotify '
+                           f'(default when inotify is unavailable: {POLL_INTERVAL:g})')
+    
+    trash = commands.add_parser('trash', help='move files to the recycle bin in parallel batches')
+    trash.add_argument('list', help="file with one path per line or scan JSON Lines output; '-' reads stdin "
+                                    "(groups scanned with keep rules trash every member not kept)")
+    trash.add_argument('--field', default='path1',
+                       help='field holding the path when reading scan JSON Lines (default: path1)')
+    trash.add_argument('--dry-run', action='store_true', help='only write the journal, do not move anything')
+    trash.add_argument('--journal', metavar='PATH', help='journal file (default: journals/ next to the application)')
+    trash.add_argument('--batch-size', type=int, default=TRASH_BATCH_SIZE, help='files per send2trash call')
+    trash.add_argument('--workers', type=int, default=TRASH_WORKERS, help='batches moved at the same time')
+    
+    link = commands.add_parser('link', help='replace duplicates with reflinks or hardlinks to the copy that is kept')
+    link.add_argument('list', help="scan JSON Lines output or 'DUPLICATE<TAB>KEPT' lines; '-' reads stdin")
+    link.add_argument('--field', default='path1', choices=['path1', 'path2'],
+                      help='with scan pairs, the side that is replaced, the other is kept (default: path1); '
+                           'with --groups output the member picked by keep rules, else the first one, is kept')
+    link.add_argument('--mode', choices=LINK_MODES, default='auto',
+                      help='auto clones with reflinks where the file system supports them (btrfs, xfs) '
+                           'and falls back to hardlinks (default: auto)')
+    link.add_argument('--dry-run', action='store_true', help='only write the journal, do not link anything')
+    link.add_argument('--journal', metavar='PATH', help='journal file (default: journals/ next to the application)')
+    link.add_argument('--workers', type=int, default=LINK_WORKERS, help='batches linked at the same time')
+    
+    diff = commands.add_parser('diff', help='print duplicate groups that are new, resolved or changed between two snapshots')
+    diff.add_argument('old', help='snapshot of the earlier scan')
+    diff.add_argument('new', help='snapshot of the later scan')
+    diff.add_argument('--check', action='store_true',
+                      help='exit with status 1 if there are new groups or groups with added files')
+    
+    serve = commands.add_parser('serve', help='watch folders and answer duplicate queries from other machines over HTTP')
+    serve.add_argument('paths', nargs='+', metavar='DIR', help='folders to index')
+    serve.add_argument('--host', default=SERVER_HOST,
+                       help='address to listen on; use 0.0.0.0 to accept other machines (default: %(default)s)')
+    serve.add_argument('--port', type=int, default=SERVER_PORT, help='port to listen on (default: %(default)s)')
+    serve.add_argument('--ext', type=parse_extensions,
+                       help=f"comma separated extensions (default: the rules file's, "
+                            f"else {','.join(DEFAULT_EXTENSIONS)})")
+    serve.add_argument('--rules', metavar='FILE', help='JSON rules file with extension groups and include/exclude globs')
+    serve.add_argument('--match', choices=['name', 'content', 'structure'], default='content',
+                       help='how the duplicate groups of /groups are matched (default: content)')
+    serve.add_argument('--archives', action='store_true', help='also index files inside .rpf archives')
+    serve.add_argument('--no-index', action='store_true', help='do not read or update the persistent hash index')
+    serve.add_argument('--index', metavar='PATH', help='hash index file (default: next to the application)')
+    serve.add_argument('--workers', type=int, default=SCAN_WORKERS, help='directory walking threads')
+    serve.add_argument('--hash-workers', type=int, default=HASH_WORKERS, help='hashing threads')
+    serve.add_argument('--chunk-size', type=int, default=HASH_CHUNK_SIZE, help='read size in bytes for full hashes')
+    serve.add_argument('--poll', type=float, metavar='SECONDS',
+                       help='poll for changes every SECONDS instead of using inotify '
+                            '(needed for network shares, where inotify misses changes made by other machines)')
+    
+    query = commands.add_parser('query', help='ask a running server whether files are already in its folders')
+    query.add_argument('files', nargs='*', metavar='FILE', help='local files to look up')
+    query.add_argument('--by', choices=['content', 'name'], default='content',
+                       help='look files up by content hash, or by filename only without reading them (default: content)')
+    query.add_argument('--server', default=f'http://{SERVER_HOST}:{SERVER_PORT}', help='server URL (default: %(default)s)')
+    query.add_argument('--status', action='store_true', help='print the folders and file count of the server')
+    query.add_argument('--groups', action='store_true', help='print the current duplicate groups of the server')
+    
+    undo = commands.add_parser('undo', help='restore files moved to the trash by a journaled run (Linux)')
+    undo.add_argument('journal', help='journal written by trash')
+    
+    return parser
+
+
+def report_progress(progress, stop, interval=1.0):
+    """Print ScanProgress snapshots to stderr until stop is set."""
+    while not stop.wait(interval):
+        snap = progress.snapshot()
+        eta = f"{snap['eta']:.0f}s" if snap['eta'] is not None else "?"
+        print(
+            f"[{snap['stage']}] {snap['files_walked']} files, "
+            f"{snap['bytes_hashed']}/{snap['bytes_to_hash']} bytes hashed, "
+            f"{snap['groups_found']} groups, ETA {eta}",
+            file=sys.stderr
+        )
+
+
+def read_rules_option(args):
+    """Return the rules and extensions of --rules and --ext. Raises OSError or ValueError for a bad rules file."""
+    rules = load_rules(args.rules) if args.rules else None
+    extensions = args.ext or (rules.extensions if rules is not None else None) or set(DEFAULT_EXTENSIONS)
+    return rules, extensions
+
+
+def run_scan(args):
+    """Run a headless scan and stream the results to stdout."""
+    if len(args.paths) < 2:
+        print("At least two folders are required", file=sys.stderr)
+        return 2
+    for path in args.paths:
+        if not os.path.isdir(path):
+            print(f"Folder not found: {path}", file=sys.stderr)
+            return 2
+    try:
+        check_roots(args.paths)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    
+    try:
+        rules, extensions = read_rules_option(args)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    
+    profiler = None
+    if args.profile or args.profile_out:
+        profiler = ScanProfiler(use_cprofile=bool(args.profile_out))
+    
+    scanner = DuplicateScanner(
+        extensions,
+        match_mode=args.match,
+        use_index=not args.no_index,
+        index_path=args.index,
+        scan_workers=args.workers,
+        hash_workers=args.hash_workers,
+        chunk_size=args.chunk_size,
+        profiler=profiler,
+        near_threshold=args.similarity,
+        archives=args.archives,
+        rules=rules
+    )
+    # Keep flags only fit on group records
+    keep = rules is not None and bool(rules.keep)
+    groups = args.groups or keep or len(args.paths) > 2
+    if args.watch:
+        if args.match == 'near':
+            print("--watch does not support --match near", file=sys.stderr)
+            return 2
+        if args.snapshot:
+            print("--watch does not support --snapshot", file=sys.stderr)
+            return 2
+        return run_watch(args, scanner, groups)
+    if args.snapshot:
+        # Fail before the scan rather than after it
+        folder = os.path.dirname(os.path.abspath(args.snapshot))
+        if not os.path.isdir(folder) or not os.access(folder, os.W_OK):
+            print(f"Cannot write the snapshot to {folder}", file=sys.stderr)
+            return 2
+    
+    if args.format == 'csv':
+        import csv
+        fields = CSV_GROUP_FIELDS if groups else CSV_FIELDS
+        if keep:
+            fields = fields + [CSV_KEEP_FIELD]
+        if args.match == 'near' and not groups:
+            fields = fields + ['similarity']
+        writer = csv.DictWriter(sys.stdout, fieldnames=fields, lineterminator='\n')
+        writer.writeheader()
+    
+    stop_reporting = threading.Event()
+    if args.progress:
+        threading.Thread(
+            target=report_progress, args=(scanner.progress, stop_reporting), daemon=True
+        ).start()
+    
+    count = 0
+    total_size = 0
+    output_time = 0.0
+    scanned = [] if args.snapshot else None
+    try:
+        for group in scanner.scan_groups(args.paths):
+            start = time.perf_counter()
+            if scanned is not None:
+                scanned.append(group)
+            if keep:
+                rules.mark_keep(group, args.paths)
+            if groups:
+                # Report folders by path instead of by index
+                members = [dict(member, root=args.paths[member['root']]) for member in group['members']]
+                records = [dict(group, members=members)]
+            else:
+                records = [pair.as_dict() for pair in scanner.group_pairs(group)]
+            for record in records:
+                if args.format == 'csv' and groups:
+                    for member in record['members']:
+                        writer.writerow(dict(member, group=count, key=record['key']))
+                elif args.format == 'csv':
+                    writer.writerow(record)
+                else:
+                    sys.stdout.write(json.dumps(record) + '\n')
+                count += 1
+                total_size += record['size']
+            output_time += time.perf_counter() - start
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Output was closed early (e.g. piped into head)
+        sys.stderr.close()
+        return 0
+    except KeyboardInterrupt:
+        scanner.cancel()
+        print("Scan cancelled", file=sys.stderr)
+        return 130
+    finally:
+        stop_reporting.set()
+    
+    kind = "duplicate group(s)" if groups else "duplicate file(s)"
+    print(f"{count} {kind}, {total_size} bytes", file=sys.stderr)
+    if scanner.progress.archives_skipped:
+        print(f"{scanner.progress.archives_skipped} archive(s) skipped (encrypted or unreadable)", file=sys.stderr)
+    if scanned is not None:
+        try:
+            saved = save_snapshot(args.snapshot, scanned, args.paths, args.match, extensions)
+        except OSError as e:
+            print(f"Cannot save the snapshot: {e}", file=sys.stderr)
+            return 2
+        print(f"Snapshot of {saved} group(s) saved to {args.snapshot}", file=sys.stderr)
+    
+    if profiler is not None:
+        profiler.add('output', output_time)
+        print(profiler.format_summary(), file=sys.stderr)
+        if args.profile_out:
+            profiler.cprofile.dump_stats(args.profile_out)
+    return 0
+
+
+def pair_events(scanner, event):
+    """Turn a DuplicateWatcher event into (event, DuplicatePair) tuples."""
+    def pairs(group):
+        if group is None:
+            return {}
+        return {(p.path1, p.path2, p.size): p for p in scanner.group_pairs(group)}
+    
+    old = pairs(event['previous'])
+    new = pairs(event['group'] if event['event'] != 'removed' else None)
+    for key in old.keys() - new.keys():
+        yield 'removed', old[key]
+    for key in new.keys() - old.keys():
+        yield 'added', new[key]
+
+
+def run_watch(args, scanner, groups):
+    """Print the initial duplicates, then events for every change until interrupted."""
+    watcher = DuplicateWatcher(scanner, args.paths)
+    keep = scanner.rules is not None and bool(scanner.rules.keep)
+    writer = None
+    if args.format == 'csv':
+        import csv
+        fields = ['event'] + (CSV_GROUP_FIELDS if groups else CSV_FIELDS)
+        writer = csv.DictWriter(
+            sys.stdout, fieldnames=fields + [CSV_KEEP_FIELD] if keep else fields, lineterminator='\n'
+        )
+        writer.writeheader()
+    count = [0]
+    
+    def write(record):
+        if writer is not None:
+            writer.writerow(record)
+        else:
+            sys.stdout.write(json.dumps(record) + '\n')
+    
+    def emit(events):
+        for event in events:
+            if groups:
+                group = event['group']
+                if keep:
+                    scanner.rules.mark_keep(group, args.paths)
+                members = [dict(m, root=args.paths[m['root']]) for m in group['members']]
+                if writer is not None:
+                    for member in members:
+                        write(dict(member, event=event['event'], group=count[0], key=group['key']))
+                else:
+                    write(dict(group, event=event['event'], members=members))
+                count[0] += 1
+            else:
+                for name, pair in pair_events(scanner, event):
+                    write(dict(pair.as_dict(), event=name))
+        sys.stdout.flush()
+    
+    try:
+        # Watch before walking so changes made during the first pass are not lost
+        source = open_watch_source(
+            watcher.roots, watcher.source_extensions(), args.poll, scanner.scan_workers, scanner.rules
+        )
+        try:
+            emit(watcher.start())
+            how = 'inotify' if isinstance(source, InotifySource) else f'polling every {source.interval:g}s'
+            print(f"Watching {len(args.paths)} folder(s) ({how}), press Ctrl+C to stop", file=sys.stderr)
+            watcher.watch(source, emit)
+        finally:
+            source.close()
+    except BrokenPipeError:
+        sys.stderr.close()
+    except KeyboardInterrupt:
+        scanner.cancel()
+    finally:
+        watcher.close()
+    return 0
+
+
+def read_path_list(source, field):
+    """
+    Read paths from a text list or from scan JSON Lines.
+    
+    Returns (paths, kept) where kept lists the files the records keep: the
+    other path of a pair or the kept members of a group. Raises OSError if
+    the list cannot be read and ValueError naming the line of a bad record.
+    """
+    f = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        paths = []
+        kept = []
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith('{'):
+                paths.append(line)
+                continue
+            try:
+                record = json.loads(line)
+                if 'members' in record:
+                    # Only groups whose keep rules picked a file to keep lose members
+                    paths.extend(m['path'] for m in record['members'] if m.get('keep') is False)
+                    kept.extend(m['path'] for m in record['members'] if m.get('keep'))
+                else:
+                    paths.append(record[field])
+                    other = record.get('path2' if field == 'path1' else 'path1')
+                    if other:
+                        kept.append(other)
+            except KeyError as e:
+                raise ValueError(f"{source}, line {number}: record has no {e} field") from None
+            except (AttributeError, TypeError, ValueError) as e:
+                raise ValueError(f"{source}, line {number}: bad record ({e})") from None
+        return paths, kept
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def run_trash(args):
+    """Move listed files to the recycle bin."""
+    if not args.dry_run and not has_send2trash():
+        print(SEND2TRASH_MISSING, file=sys.stderr)
+        return 2
+    try:
+        paths, kept = read_path_list(args.list, args.field)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    
+    def progress(done, total):
+        print(f"{done}/{total}", file=sys.stderr)
+    
+    summary = trash_files(
+        paths,
+        dry_run=args.dry_run,
+        journal_path=args.journal,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        progress=progress,
+        keep=kept
+    )
+    verb = "would be moved" if args.dry_run else "moved"
+    print(
+        f"{summary['moved']} file(s) {verb}, {summary['missing']} missing, "
+        f"{summary['errors']} error(s)\nJournal: {summary['journal']}",
+        file=sys.stderr
+    )
+    return 1 if summary['errors'] else 0
+
+
+def read_pair_list(source, field):
+    """
+    Read (path, kept path) pairs from scan JSON Lines or tab separated lines.
+    
+    Raises OSError if the list cannot be read and ValueError naming the
+    line of a bad record.
+    """
+    f = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        pairs = []
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith('{'):
+                path, _, kept = line.partition('\t')
+                pairs.append((path, kept))
+                continue
+            try:
+                record = json.loads(line)
+                if 'members' in record:
+                    members = record['members']
+                    kept = next((m for m in members if m.get('keep')), members[0])
+                    pairs.extend((m['path'], kept['path']) for m in members if m is not kept)
+                else:
+                    pairs.append((record[field], record['path2' if field == 'path1' else 'path1']))
+            except KeyError as e:
+                raise ValueError(f"{source}, line {number}: record has no {e} field") from None
+            except (AttributeError, IndexError, TypeError, ValueError) as e:
+                raise ValueError(f"{source}, line {number}: bad record ({e})") from None
+        return pairs
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def run_link(args):
+    """Replace listed duplicates with links to the copies that are kept."""
+    try:
+        pairs = read_pair_list(args.list, args.field)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    for path, kept in pairs:
+        if not kept:
+            print(f"No file to keep for: {path}", file=sys.stderr)
+            return 2
+    
+    def progress(done, total):
+        print(f"{done}/{total}", file=sys.stderr)
+    
+    summary = link_files(
+        pairs,
+        mode=args.mode,
+        dry_run=args.dry_run,
+        journal_path=args.journal,
+        workers=args.workers,
+        progress=progress
+    )
+    verb = "would be linked" if args.dry_run else "linked"
+    print(
+        f"{summary['linked']} file(s) {verb} ({summary['reclaimed']} bytes), {summary['skipped']} skipped, "
+        f"{summary['missing']} missing, {summary['errors']} error(s)\nJournal: {summary['journal']}",
+        file=sys.stderr
+    )
+    return 1 if summary['errors'] else 0
+
+
+def run_diff(args):
+    """Print the differences between two snapshots as JSON Lines."""
+    try:
+        old = load_snapshot(args.old)
+        new = load_snapshot(args.new)
+        changes = list(diff_snapshots(old, new))
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    
+    counts = dict.fromkeys(('new', 'resolved', 'changed'), 0)
+    regressions = 0
+    try:
+        for record in changes:
+            sys.stdout.write(json.dumps(record) + '\n')
+            counts[record['change']] += 1
+            if record['change'] == 'new' or record.get('added'):
+                regressions += 1
+        sys.stdout.flush()
+    except BrokenPipeError:
+        sys.stderr.close()
+        return 0
+    print(
+        f"{counts['new']} new, {counts['resolved']} resolved, {counts['changed']} changed group(s)",
+        file=sys.stderr
+    )
+    return 1 if args.check and regressions else 0
+
+
+def run_serve(args):
+    """Index folders once, keep the index up to date and answer queries until interrupted."""
+    for path in args.paths:
+        if not os.path.isdir(path):
+            print(f"Folder not found: {path}", file=sys.stderr)
+            return 2
+    try:
+        check_roots(args.paths)
+        rules, extensions = read_rules_option(args)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    from http.server import ThreadingHTTPServer
+    
+    scanner = DuplicateScanner(
+        extensions,
+        match_mode=args.match,
+        use_index=not args.no_index,
+        index_path=args.index,
+        scan_workers=args.workers,
+        hash_workers=args.hash_workers,
+        chunk_size=args.chunk_size,
+        archives=args.archives,
+        rules=rules
+    )
+    server = DuplicateServer(scanner, args.paths)
+    try:
+        httpd = ThreadingHTTPServer((args.host, args.port), make_query_handler(server))
+    except OSError as e:
+        print(f"Cannot listen on {args.host}:{args.port}: {e}", file=sys.stderr)
+        return 2
+    httpd.daemon_threads = True
+    serving = None
+    
+    try:
+        # Watch before walking so changes made during the first pass are not lost
+        source = open_watch_source(
+            server.watcher.roots, server.watcher.source_extensions(), args.poll, args.workers, rules
+        )
+        try:
+            server.start()
+            serving = threading.Thread(target=httpd.serve_forever, daemon=True)
+            serving.start()
+            how = 'inotify' if isinstance(source, InotifySource) else f'polling every {source.interval:g}s'
+            print(
+                f"{len(server.watcher.files)} file(s) indexed, serving on http://{args.host}:{args.port} "
+                f"({how}), press Ctrl+C to stop",
+                file=sys.stderr
+            )
+            server.run(source)
+        finally:
+            source.close()
+    except KeyboardInterrupt:
+        scanner.cancel()
+    finally:
+        # shutdown() waits for serve_forever(), which never ran if the walk was interrupted
+        if serving is not None:
+            httpd.shutdown()
+        httpd.server_close()
+        server.close()
+    return 0
+
+
+def run_query(args):
+    """Look files up on a running server and print the answers as JSON Lines."""
+    try:
+        if args.status or args.groups:
+            answer = query_server(args.server, '/status' if args.status else '/groups')
+            records = [answer] if args.status else answer['groups']
+            for record in records:
+                sys.stdout.write(json.dumps(record) + '\n')
+            return 0
+        
+        found = 0
+        for path in args.files:
+            if args.by == 'name':
+                params = {'name': os.path.basename(path)}
+            else:
+                try:
+                    params = file_query(path)
+                except OSError as e:
+                    print(f"Cannot read {path}: {e}", file=sys.stderr)
+                    return 2
+            matches = query_server(args.server, '/lookup', **params)['matches']
+            sys.stdout.write(json.dumps({'file': path, 'matches': matches}) + '\n')
+            found += bool(matches)
+        sys.stdout.flush()
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"{found} of {len(args.files)} file(s) already on the server", file=sys.stderr)
+    return 0
+
+
+def run_undo(args):
+    """Restore files listed in a trash journal."""
+    restored, failed = restore_from_journal(args.journal)
+    for path in failed:
+        print(f"Not restored: {path}", file=sys.stderr)
+    print(f"{len(restored)} file(s) restored, {len(failed)} not restored", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def run_gui():
+    load_gui()
     root = tk.Tk()
     
     # Configure icon if available
@@ -546,7 +4945,27 @@ def main():
     
     app = DuplicateFinderApp(root)
     root.mainloop()
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'scan':
+        return run_scan(args)
+    if args.command == 'trash':
+        return run_trash(args)
+    if args.command == 'link':
+        return run_link(args)
+    if args.command == 'diff':
+        return run_diff(args)
+    if args.command == 'serve':
+        return run_serve(args)
+    if args.command == 'query':
+        return run_query(args)
+    if args.command == 'undo':
+        return run_undo(args)
+    return run_gui()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())